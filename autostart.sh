@@ -1,11 +1,26 @@
 #!/bin/bash
 
+# Several workers need a cache backend shared between processes (redis or memcached, see README.md): without one the
+# server runs a single worker
+if [ -z "$CACHE_BACKEND" ]; then
+    export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+fi
+
 # Run database migrations
-python manage.py makemigrations
 python manage.py migrate
 
-# Collect movie and planet data
-python manage.py load_data
+# Collect movie and planet data, from the baked snapshot when the image ships one
+CATALOG_SNAPSHOT=${CATALOG_SNAPSHOT:-catalog.ndjson.gz}
+if [ -f "$CATALOG_SNAPSHOT" ]; then
+    python manage.py import_catalog "$CATALOG_SNAPSHOT"
+else
+    python manage.py load_data
+fi
+
+if [ "$DEV_SERVER" = "true" ]; then
+    # Start the Django development server
+    exec python manage.py runserver 0.0.0.0:8000
+fi
 
-# Start the Django development server
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+# Start the multi-worker server, see gunicorn.conf.py
+exec gunicorn --config gunicorn.conf.py "${APP_MODULE:-starwars.wsgi:application}"
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from core import signals  # noqa: F401
+        from core.caching import list_cache_metrics
+        from core.favorites import favorite_set_metrics
+        from starwars import db  # noqa: F401
+        from starwars.metrics import metrics
+        metrics.register_collector(list_cache_metrics)
+        metrics.register_collector(favorite_set_metrics)
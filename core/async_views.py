@@ -0,0 +1,225 @@
+"""
+    Native async versions of the list and add-favorite endpoints of core.views, served when ASYNC_VIEWS is enabled
+    under ASGI. They keep the response contract of the sync views, but run on the event loop: list cache hits from the
+    in-process tier are answered without a thread hop, and database work goes through the async ORM.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from starwars.logger import Logger
+
+from .caching import alist_versions, list_cache
+from .catalog import name_indexes
+from .favorites import FAVORITE_FIELDS, aget_favorites, favorite_buffer, favorites_added, matches_custom_name
+from .lists import (
+    build_page, catalog_page_key, list_response, movie_queryset, movie_row, overlay_fragments, planet_queryset,
+    planet_row, user_movie_queryset, user_page_key, user_planet_queryset,
+)
+from .models import Movies, Planets
+from .pagination import InvalidCursor, apaginate
+
+
+logger = Logger()
+
+
+def _response(data, status=status.HTTP_200_OK):
+    # same encoding as DRF's JSONRenderer, so both flavours of the add-favorite views return identical bodies
+    return JsonResponse(data, status=status, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def _method_not_allowed(request):
+    return _response({'detail': 'Method "{}" not allowed.'.format(request.method)},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+async def add_favorite_movie(request):
+    """
+        Async version of core.views.add_favorite_movie.
+    """
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _request_data(request)
+    if data is None:
+        return _response({'detail': 'JSON parse error'}, status=status.HTTP_400_BAD_REQUEST)
+    movie_title = data.get('title')
+    user_id = data.get('user_id')
+    custom_title = data.get('custom_title')
+
+    logger.info(msg='adding {} movie as fav movie for user: {}'.format(movie_title, user_id))
+
+    if not movie_title or not user_id:
+        logger.error(msg='Missing required data: {} and {}'.format(movie_title, user_id))
+        return _response({'error': 'Missing required data'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not isinstance(movie_title, str):
+        logger.error(msg='Invalid title: {!r}'.format(movie_title))
+        return _response({'error': 'Invalid title'}, status=status.HTTP_400_BAD_REQUEST)
+    if custom_title is not None and not isinstance(custom_title, str):
+        logger.error(msg='Invalid custom title: {!r}'.format(custom_title))
+        return _response({'error': 'Invalid custom title'}, status=status.HTTP_400_BAD_REQUEST)
+
+    movie_id = await name_indexes[Movies].alookup(movie_title)
+    if movie_id is None:
+        logger.error(msg='Movie not found, movie title: {}'.format(movie_title))
+        return _response({'error': 'Movie not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    favorite_movie_id, is_created = await _aadd_favorite(Movies, user_id, movie_id, custom_title)
+
+    if not is_created:
+        logger.warn(msg='Movie already added as favorite, movie title: {}'.format(movie_title))
+        return _response({'success': 'Movie already added as favorite', 'favorite_movie': favorite_movie_id},
+                            status=status.HTTP_200_OK)
+
+    logger.info(msg='Movie added as favorite, movie title: {}'.format(movie_title))
+    return _response({'success': 'Movie added as favorite', 'favorite_movie': favorite_movie_id},
+                        status=status.HTTP_201_CREATED)
+
+
+async def add_favorite_planet(request):
+    """
+        Async version of core.views.add_favorite_planet.
+    """
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _request_data(request)
+    if data is None:
+        return _response({'detail': 'JSON parse error'}, status=status.HTTP_400_BAD_REQUEST)
+    planet_name = data.get('name')
+    user_id = data.get('user_id')
+    custom_name = data.get('custom_name')
+
+    logger.info(msg='adding {} planet as fav planet for user: {}'.format(planet_name, user_id))
+
+    if not planet_name or not user_id:
+        logger.error(msg='Missing required data: {} and {}'.format(planet_name, user_id))
+        return _response({'error': 'Missing required data'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not isinstance(planet_name, str):
+        logger.error(msg='Invalid name: {!r}'.format(planet_name))
+        return _response({'error': 'Invalid name'}, status=status.HTTP_400_BAD_REQUEST)
+    if custom_name is not None and not isinstance(custom_name, str):
+        logger.error(msg='Invalid custom name: {!r}'.format(custom_name))
+        return _response({'error': 'Invalid custom name'}, status=status.HTTP_400_BAD_REQUEST)
+
+    planet_id = await name_indexes[Planets].alookup(planet_name)
+    if planet_id is None:
+        logger.error(msg='Planet not found, movie title: {}'.format(planet_name))
+        return _response({'error': 'Planet not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    favorite_planet_id, is_created = await _aadd_favorite(Planets, user_id, planet_id, custom_name)
+
+    if not is_created:
+        logger.warn(msg='Planet already added as favorite, planet name: {}'.format(planet_name))
+        return _response({'success': 'Planet already added as favorite', 'favorite_planet': favorite_planet_id},
+                            status=status.HTTP_200_OK)
+
+    logger.info(msg='Planet added as favorite, planet name: {}'.format(planet_name))
+    return _response({'success': 'Planet added as favorite', 'favorite_planet': favorite_planet_id},
+                        status=status.HTTP_201_CREATED)
+
+
+async def _aadd_favorite(model, user_id, catalog_id, custom_name):
+    """
+        Async version of core.views._add_favorite.
+    """
+    if favorite_buffer.enabled:
+        created = await sync_to_async(favorite_buffer.add)(model, user_id, {catalog_id: custom_name})
+        return None, catalog_id in created
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+    favorite, is_created = await favorite_model.objects.aget_or_create(
+        user_id=user_id,
+        **{id_field: catalog_id},
+        defaults={name_field: custom_name},
+    )
+    if is_created:
+        await sync_to_async(favorites_added)(model, user_id, {catalog_id: custom_name})
+    return favorite.id, is_created
+
+
+# DRF's api_view exempts the sync views from CSRF checks; csrf_exempt cannot wrap coroutines before Django 5.0
+add_favorite_movie.csrf_exempt = True
+add_favorite_planet.csrf_exempt = True
+
+
+async def get_planet_list(request, *args, **kwargs):
+    """
+        Async version of core.views.get_planet_list.
+    """
+    if request.method != 'GET':
+        return _method_not_allowed(request)
+    user_id = request.GET.get('user_id')
+    query = request.GET.get('search_by')
+    catalog_version, favorites_version = await alist_versions(Planets, user_id)
+    favourite_planets = await aget_favorites(Planets, user_id, favorites_version)
+    try:
+        if query and matches_custom_name(favourite_planets, query):
+            key = user_page_key(request, Planets, user_id, catalog_version, favorites_version, query)
+            page = await list_cache.aget_or_set(
+                key,
+                lambda: _abuild_page(
+                    request, lambda: user_planet_queryset(user_id, query), planet_row, 'name', favourite_planets,
+                ),
+            )
+            fragments = page['fragments']
+        else:
+            key = catalog_page_key(request, Planets, catalog_version, query)
+            page = await list_cache.aget_or_set(
+                key,
+                lambda: _abuild_page(request, lambda: planet_queryset(query), planet_row, 'name'),
+            )
+            fragments = overlay_fragments(page, favourite_planets, 'name')
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return list_response(request, 'planet-list', page, fragments)
+
+
+async def get_movie_list(request, *args, **kwargs):
+    """
+        Async version of core.views.get_movie_list.
+    """
+    if request.method != 'GET':
+        return _method_not_allowed(request)
+    user_id = request.GET.get('user_id')
+    query = request.GET.get('search_by')
+    catalog_version, favorites_version = await alist_versions(Movies, user_id)
+    favorite_movies = await aget_favorites(Movies, user_id, favorites_version)
+    try:
+        if query and matches_custom_name(favorite_movies, query):
+            key = user_page_key(request, Movies, user_id, catalog_version, favorites_version, query)
+            page = await list_cache.aget_or_set(
+                key,
+                lambda: _abuild_page(
+                    request, lambda: user_movie_queryset(user_id, query), movie_row, 'title', favorite_movies,
+                ),
+            )
+            fragments = page['fragments']
+        else:
+            key = catalog_page_key(request, Movies, catalog_version, query)
+            page = await list_cache.aget_or_set(
+                key,
+                lambda: _abuild_page(request, lambda: movie_queryset(query), movie_row, 'title'),
+            )
+            fragments = overlay_fragments(page, favorite_movies, 'title')
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return list_response(request, 'movie-list', page, fragments)
+
+
+async def _abuild_page(request, make_queryset, row, name_field, favorites=None):
+    # building a search queryset may probe the database for the search indexes, which only works off the event loop
+    queryset = await sync_to_async(make_queryset)()
+    return build_page(*await apaginate(request, queryset), row, name_field, favorites)
@@ -0,0 +1,181 @@
+import json
+import math
+import random
+import re
+from collections import Counter, namedtuple
+
+from django.urls import Resolver404, resolve, reverse
+
+# a request replayed by the benchmark command; params are sent as the query string, data as a JSON body
+Call = namedtuple('Call', ['method', 'path', 'params', 'data'])
+
+# relative weights of the kinds of requests of the synthetic traffic
+DEFAULT_MIX = {'list': 60, 'search': 30, 'favorite': 10}
+
+PERCENTILES = (50, 95, 99)
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_mix(value):
+    """
+        Parses a `kind=weight,...` traffic mix, e.g. `list=60,search=30,favorite=10`.
+    """
+    mix = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        kind, weight = item.split('=')
+        if kind not in DEFAULT_MIX:
+            raise ValueError('Unknown request kind: {}'.format(kind))
+        mix[kind] = float(weight)
+    return mix
+
+
+def read_traffic(path):
+    """
+        Reads recorded traffic: one JSON object per line with a `method` (GET by default), a `path` (which may carry a
+        query string) and optional `params` and `data` objects.
+    """
+    calls = []
+    with open(path) as traffic:
+        for line_number, line in enumerate(traffic, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                calls.append(Call(entry.get('method', 'GET').upper(), entry['path'], entry.get('params') or {},
+                                  entry.get('data')))
+            except (ValueError, KeyError, AttributeError):
+                raise ValueError('Invalid traffic entry on line {}'.format(line_number))
+    return calls
+
+
+def synthetic_traffic(count, planets, movies, mix=None, users=100, seed=None):
+    """
+        Returns `count` calls mixing list pages, searches on a few letters of a catalog name and favorite additions,
+        for users drawn from 1..`users` (a fifth of the list and search requests are anonymous).
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    catalogs = [(names, list_view, favorite_view, field) for names, list_view, favorite_view, field in (
+        (planets, 'planet-list', 'add_favorite_planet', 'name'),
+        (movies, 'movie-list', 'add_favorite_movie', 'title'),
+    ) if names]
+    calls = []
+    for kind in rng.choices(kinds, weights, k=count):
+        names, list_view, favorite_view, field = rng.choice(catalogs)
+        user_id = rng.randint(1, users)
+        if kind == 'favorite':
+            calls.append(Call('POST', reverse(favorite_view), {}, {field: rng.choice(names), 'user_id': user_id}))
+            continue
+        params = {'user_id': user_id} if rng.random() >= 0.2 else {}
+        if kind == 'search':
+            name = rng.choice(names)
+            start = rng.randrange(max(len(name) - 2, 1))
+            params['search_by'] = name[start:start + rng.randint(3, 5)]
+        calls.append(Call('GET', reverse(list_view), params, None))
+    return calls
+
+
+def endpoint_name(path):
+    try:
+        return resolve(path.split('?', 1)[0]).url_name or path
+    except Resolver404:
+        return path
+
+
+def percentile(values, percent):
+    """
+        Returns the nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def parse_metrics(text):
+    """
+        Parses the Prometheus text served by /metrics into a {(name, ((label, value), ...)): value} dict.
+    """
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[name, tuple(sorted(_LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+
+def metric_totals(samples, name, label):
+    """
+        Returns the values of one metric keyed by one of its labels, or by a tuple of labels.
+    """
+    totals = Counter()
+    for (sample_name, labels), value in samples.items():
+        if sample_name == name:
+            labels = dict(labels)
+            totals[tuple(labels.get(key) for key in label) if isinstance(label, tuple) else labels.get(label)] += value
+    return totals
+
+
+def hit_ratio(cache, view=None):
+    """
+        Returns the list cache hit ratio of one view, or of all of them, from the (view, event) cache counters.
+    """
+    events = Counter()
+    for (event_view, event), count in cache.items():
+        if view is None or event_view == view:
+            events[event] += count
+    hits = events['local_hits'] + events['shared_hits']
+    return round(hits / (hits + events['misses']), 4) if hits + events['misses'] else None
+
+
+def summarize(timings, elapsed, before, after):
+    """
+        Returns the results of a run: throughput and latency percentiles per endpoint, from the (endpoint, status,
+        seconds) timings of the calls, and the queries per request and cache hit ratio, from the /metrics samples taken
+        before and after the run.
+    """
+    queries = metric_totals(after, 'starwars_db_queries_total', 'view')
+    queries.subtract(metric_totals(before, 'starwars_db_queries_total', 'view'))
+    cache = metric_totals(after, 'starwars_list_cache_events_total', ('view', 'event'))
+    cache.subtract(metric_totals(before, 'starwars_list_cache_events_total', ('view', 'event')))
+
+    endpoints = {}
+    for endpoint in sorted({endpoint for endpoint, status, seconds in timings}):
+        latencies = sorted(seconds for name, status, seconds in timings if name == endpoint)
+        results = {
+            'requests': len(latencies),
+            'errors': sum(1 for name, status, seconds in timings if name == endpoint and status >= 500),
+            'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+            'queries_per_request': round(queries[endpoint] / len(latencies), 2),
+            'cache_hit_ratio': hit_ratio(cache, endpoint),
+        }
+        for percent in PERCENTILES:
+            results['p{}_ms'.format(percent)] = round(percentile(latencies, percent) * 1000, 3)
+        endpoints[endpoint] = results
+    return {
+        'requests': len(timings),
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(timings) / elapsed, 2) if elapsed else None,
+        'cache_hit_ratio': hit_ratio(cache),
+        'endpoints': endpoints,
+    }
+
+
+def regressions(results, baseline, threshold):
+    """
+        Returns a description of every endpoint whose p95 latency grew, or whose throughput dropped, by more than the
+        threshold (a fraction) compared to the baseline results.
+    """
+    found = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        if previous.get('p95_ms') and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            found.append('{}: p95 {}ms -> {}ms'.format(endpoint, previous['p95_ms'], current['p95_ms']))
+        if previous.get('throughput') and current['throughput'] < previous['throughput'] * (1 - threshold):
+            found.append('{}: throughput {}/s -> {}/s'.format(endpoint, previous['throughput'], current['throughput']))
+    return found
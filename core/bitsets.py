@@ -0,0 +1,125 @@
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from itertools import groupby
+
+# a chunk groups 2 ** CHUNK_SHIFT consecutive ids, stored as a bitmap of CHUNK_BYTES bytes when it is dense
+CHUNK_SHIFT = 12
+CHUNK_MASK = (1 << CHUNK_SHIFT) - 1
+CHUNK_BYTES = 1 << CHUNK_SHIFT - 3
+# a chunk becomes a bitmap once its ids would take more room in the sorted array, at 8 bytes per id
+DENSE_CHUNK_IDS = CHUNK_BYTES // 8
+
+
+class SparseBitset:
+    """
+        A set of non-negative integers, held in a sorted array of 8-byte ids whose dense ranges are moved to bitmaps.
+
+        Ids are grouped in chunks keyed by id >> CHUNK_SHIFT. A chunk holding more than DENSE_CHUNK_IDS ids is stored
+        as a bitmap, one bit per id; the ids of the other chunks stay in the sorted array. The memory used is therefore
+        about the smaller of both: 8 bytes per sparse id whatever its value, one bit per id in dense ranges. Membership
+        tests are a dict lookup, then a byte lookup or a binary search.
+    """
+
+    __slots__ = ('_ids', '_chunks', '_count')
+
+    def __init__(self, ids=()):
+        self._ids = array('q')
+        self._chunks = {}
+        self._count = 0
+        self.update(ids)
+
+    def add(self, value):
+        if value < 0:
+            raise ValueError('Negative ids cannot be added: {}'.format(value))
+        key = value >> CHUNK_SHIFT
+        chunk = self._chunks.get(key)
+        if chunk is not None:
+            self._count += _set_bit(chunk, value)
+            return
+        index = bisect_left(self._ids, value)
+        if index < len(self._ids) and self._ids[index] == value:
+            return
+        self._ids.insert(index, value)
+        self._count += 1
+        start, end = bisect_left(self._ids, key << CHUNK_SHIFT), bisect_left(self._ids, key + 1 << CHUNK_SHIFT)
+        if end - start > DENSE_CHUNK_IDS:
+            chunk = self._chunks[key] = bytearray(CHUNK_BYTES)
+            for dense_value in self._ids[start:end]:
+                _set_bit(chunk, dense_value)
+            del self._ids[start:end]
+
+    def update(self, ids):
+        """
+            Adds many ids at once, sorting them once instead of inserting them one by one in the array.
+        """
+        values = set(ids)
+        if values and min(values) < 0:
+            raise ValueError('Negative ids cannot be added: {}'.format(min(values)))
+        values.update(self._ids)
+        self._count -= len(self._ids)
+        self._ids = array('q')
+        for key, group in groupby(sorted(values), lambda value: value >> CHUNK_SHIFT):
+            group = list(group)
+            chunk = self._chunks.get(key)
+            if chunk is None and len(group) > DENSE_CHUNK_IDS:
+                chunk = self._chunks[key] = bytearray(CHUNK_BYTES)
+            if chunk is None:
+                self._ids.extend(group)
+                self._count += len(group)
+            else:
+                self._count += sum(_set_bit(chunk, value) for value in group)
+
+    def copy(self):
+        bitset = self.__class__()
+        bitset._ids = array('q', self._ids)
+        bitset._chunks = {key: bytearray(chunk) for key, chunk in self._chunks.items()}
+        bitset._count = self._count
+        return bitset
+
+    def __contains__(self, value):
+        try:
+            chunk = self._chunks.get(value >> CHUNK_SHIFT)
+        except TypeError:
+            return False
+        if chunk is not None:
+            return chunk[(value & CHUNK_MASK) >> 3] >> (value & 7) & 1 == 1
+        # negative values fall before the first id
+        index = bisect_left(self._ids, value)
+        return index < len(self._ids) and self._ids[index] == value
+
+    def __iter__(self):
+        # the ids of the array and of the bitmaps are disjoint, both in order
+        return merge(self._ids, self._bitmap_ids())
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self):
+        """
+            Returns the approximate number of bytes held by the bitset: the array, the bitmaps and their keys.
+        """
+        return sys.getsizeof(self._ids) + sys.getsizeof(self._chunks) + sum(
+            sys.getsizeof(key) + sys.getsizeof(chunk) for key, chunk in self._chunks.items()
+        )
+
+    def _bitmap_ids(self):
+        for key in sorted(self._chunks):
+            base = key << CHUNK_SHIFT
+            for byte, bits in enumerate(self._chunks[key]):
+                while bits:
+                    low = bits & -bits
+                    yield base + (byte << 3) + low.bit_length() - 1
+                    bits ^= low
+
+
+def _set_bit(chunk, value):
+    """
+        Sets the bit of the value in its chunk, and returns 1 when it was not set yet, 0 otherwise.
+    """
+    byte, bit = (value & CHUNK_MASK) >> 3, 1 << (value & 7)
+    if chunk[byte] & bit:
+        return 0
+    chunk[byte] |= bit
+    return 1
@@ -0,0 +1,411 @@
+import asyncio
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from decouple import config
+from django.conf import settings
+from django.core.cache import cache
+
+from starwars.metrics import Metric, record_cache_event
+
+# hours on a shared backend, a few minutes on a process-local one (see settings)
+CACHE_TIMEOUT = settings.CACHE_TIMEOUT
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+# seconds the async views reuse a version counter read by this process: the built-in cache backends only offer async
+# methods running the sync ones in a thread, which the versions of a hit would otherwise cost
+LOCAL_VERSION_TTL = config('LOCAL_VERSION_TTL', default=1.0, cast=float)
+
+# {key: (value, monotonic time it was read at)} of the version counters last read or bumped by this process
+_local_versions = {}
+
+_SAFE_KEY_PART = re.compile(r'[\w.=-]{0,64}', re.ASCII)
+
+
+def key_part(value):
+    """
+        Returns a request value as a cache key part: as is when it is short and made of safe characters, as a digest
+        otherwise, so keys stay valid for memcached whatever the request parameters are.
+    """
+    value = str(value)
+    if _SAFE_KEY_PART.fullmatch(value):
+        return value
+    return '#' + hashlib.sha1(value.encode()).hexdigest()
+
+
+def favorites_version_key(model, user_id):
+    return f'favorites_version:{model._meta.model_name}:{key_part(user_id)}'
+
+
+def get_versions(*keys):
+    """
+        Returns the current value of the given version counters, fetched in one cache round trip.
+
+        A missing counter is seeded from the clock rather than from 1, so a counter that was evicted never comes back
+        with a value that older cache entries were stored under.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            seed = time.time_ns() // 1000
+            cache.add(key, seed, timeout=None)
+            versions[key] = cache.get(key, seed)
+    _remember_versions(versions)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(*keys):
+    """
+        Async version of get_versions(). Counters read or bumped by this process less than LOCAL_VERSION_TTL seconds
+        ago are answered on the event loop, without reaching the shared cache: a bump made by another process may
+        therefore be seen that much later.
+    """
+    now = time.monotonic()
+    local = [_local_versions.get(key) for key in keys]
+    if all(entry is not None and now - entry[1] < LOCAL_VERSION_TTL for entry in local):
+        return [entry[0] for entry in local]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            seed = time.time_ns() // 1000
+            await cache.aadd(key, seed, timeout=None)
+            versions[key] = await cache.aget(key, seed)
+    _remember_versions(versions)
+    return [versions[key] for key in keys]
+
+
+def _remember_versions(versions):
+    now = time.monotonic()
+    for key, value in versions.items():
+        _local_versions[key] = (value, now)
+
+
+def bump_version(key):
+    """
+        Moves a version counter forward, so every cache entry keyed on its previous value is never read again.
+    """
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        get_versions(key)
+        version = cache.incr(key)
+    _remember_versions({key: version})
+    return version
+
+
+def list_versions(model, user_id):
+    """
+        Returns the catalog version and the favorites version of the user (None for anonymous requests) a list
+        response of the given catalog model is cached under.
+    """
+    if not user_id:
+        return get_versions(CATALOG_VERSION_KEY)[0], None
+    return tuple(get_versions(CATALOG_VERSION_KEY, favorites_version_key(model, user_id)))
+
+
+async def alist_versions(model, user_id):
+    if not user_id:
+        return (await aget_versions(CATALOG_VERSION_KEY))[0], None
+    return tuple(await aget_versions(CATALOG_VERSION_KEY, favorites_version_key(model, user_id)))
+
+
+def catalog_changed():
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_existing_versions(keys):
+    """
+        Moves forward those of the given version counters that exist, with one cache round trip to find them. A missing
+        counter needs no bump: it is seeded from the clock when next read, past any value entries were stored under.
+    """
+    for key in cache.get_many(keys):
+        try:
+            _remember_versions({key: cache.incr(key)})
+        except ValueError:
+            # evicted in between
+            pass
+
+
+_MISSING = object()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _MISSING
+        self.error = None
+
+
+class TieredCache:
+    """
+        A bounded in-process LRU in front of the shared Django cache, for values that are expensive to compute.
+
+        get_or_set() protects the computation against stampedes:
+        - single flight: only one thread per process computes a missing key, concurrent callers wait for its result,
+          and a short lock entry in the shared cache keeps other processes from computing it at the same time;
+        - early refresh: every entry remembers how long it took to compute, and each read refreshes it ahead of its
+          expiry with a probability growing as the expiry gets closer (XFetch), while other callers keep reading the
+          current value.
+
+        aget_or_set() is the asyncio flavour: local hits are answered on the event loop without any thread hop, and
+        concurrent coroutines missing the same key await a single computation. The async views read the versions in
+        their keys with aget_versions(), which only reaches the shared cache, through a thread, once its local copy
+        of the counters is older than LOCAL_VERSION_TTL.
+
+        Hits, misses, coalesced waits and early refreshes are counted and reported by stats().
+    """
+
+    def __init__(self, max_entries=1024, beta=1.0, lock_timeout=10, wait_timeout=2):
+        self.max_entries = max_entries
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self._local = OrderedDict()
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def get_or_set(self, key, compute, timeout=CACHE_TIMEOUT):
+        """
+            Returns the cached value of the key, calling compute() to (re)fill it when it is missing or picked for an
+            early refresh. Exceptions raised by compute() are propagated and nothing is cached.
+        """
+        entry = self._get_local(key)
+        tier = 'local_hits'
+        if entry is None:
+            entry = cache.get(key)
+            tier = 'shared_hits'
+            if entry is not None:
+                self._set_local(key, entry)
+        if entry is None:
+            self._count('misses')
+            return self._fill(key, compute, timeout)
+
+        if self._is_fresh(entry):
+            self._count(tier)
+            return entry[0]
+        return self._fill(key, compute, timeout, current=entry[0])
+
+    async def aget_or_set(self, key, compute, timeout=CACHE_TIMEOUT):
+        """
+            Async version of get_or_set(), where compute is a coroutine function.
+        """
+        entry = self._get_local(key)
+        tier = 'local_hits'
+        if entry is None:
+            entry = await cache.aget(key)
+            tier = 'shared_hits'
+            if entry is not None:
+                self._set_local(key, entry)
+        if entry is None:
+            self._count('misses')
+            return await self._afill(key, compute, timeout)
+        if self._is_fresh(entry):
+            self._count(tier)
+            return entry[0]
+        return await self._afill(key, compute, timeout, current=entry[0])
+
+    def get(self, key):
+        """
+            Returns the cached value of the key, or None when it is missing. Nothing is computed nor counted.
+        """
+        entry = self._get_local(key)
+        if entry is None:
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            self._set_local(key, entry)
+        return entry[0]
+
+    def set(self, key, value, timeout=CACHE_TIMEOUT):
+        """
+            Caches a value computed by the caller, in both tiers.
+        """
+        entry = (value, time.time() + timeout, 0.0)
+        cache.set(key, entry, timeout=timeout)
+        self._set_local(key, entry)
+
+    def local_values(self):
+        with self._lock:
+            return [entry[0] for entry in self._local.values()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._local)
+        for name in ('local_hits', 'shared_hits', 'misses', 'coalesced', 'early_refreshes'):
+            stats.setdefault(name, 0)
+        stats['hits'] = stats['local_hits'] + stats['shared_hits']
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._stats.clear()
+        _local_versions.clear()
+        cache.clear()
+
+    def _fill(self, key, compute, timeout, current=_MISSING):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if current is not _MISSING:
+                return current
+            self._count('coalesced')
+            if flight.done.wait(self.lock_timeout) and flight.value is not _MISSING:
+                return flight.value
+            if flight.error is not None:
+                raise flight.error
+            return compute()
+
+        lock_key = 'lock:' + key
+        locked = False
+        try:
+            locked = cache.add(lock_key, 1, timeout=self.lock_timeout)
+            if not locked:
+                # another process is computing this key: keep serving the current value, or wait for its result
+                if current is not _MISSING:
+                    flight.value = current
+                    return current
+                entry = self._wait_shared(key)
+                if entry is not None:
+                    self._set_local(key, entry)
+                    self._count('coalesced')
+                    flight.value = entry[0]
+                    return flight.value
+            elif current is not _MISSING:
+                self._count('early_refreshes')
+
+            started = time.monotonic()
+            value = compute()
+            entry = (value, time.time() + timeout, time.monotonic() - started)
+            cache.set(key, entry, timeout=timeout)
+            self._set_local(key, entry)
+            flight.value = value
+            return value
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            if locked:
+                cache.delete(lock_key)
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def _afill(self, key, compute, timeout, current=_MISSING):
+        flight_key = (id(asyncio.get_running_loop()), key)
+        flight = self._async_flights.get(flight_key)
+        if flight is not None:
+            if current is not _MISSING:
+                return current
+            self._count('coalesced')
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[flight_key] = asyncio.get_running_loop().create_future()
+        lock_key = 'lock:' + key
+        locked = False
+        try:
+            locked = await cache.aadd(lock_key, 1, timeout=self.lock_timeout)
+            if not locked and current is not _MISSING:
+                value = current
+            else:
+                if not locked:
+                    entry = await self._await_shared(key)
+                    if entry is not None:
+                        self._set_local(key, entry)
+                        self._count('coalesced')
+                        flight.set_result(entry[0])
+                        return entry[0]
+                elif current is not _MISSING:
+                    self._count('early_refreshes')
+                started = time.monotonic()
+                value = await compute()
+                entry = (value, time.time() + timeout, time.monotonic() - started)
+                await cache.aset(key, entry, timeout=timeout)
+                self._set_local(key, entry)
+            flight.set_result(value)
+            return value
+        except Exception as error:
+            flight.set_exception(error)
+            # mark the exception as retrieved when no other coroutine was waiting for it
+            flight.exception()
+            raise
+        finally:
+            if locked:
+                await cache.adelete(lock_key)
+            del self._async_flights[flight_key]
+
+    def _is_fresh(self, entry):
+        value, expires_at, delta = entry
+        return time.time() - delta * self.beta * math.log(random.random() or 1e-12) < expires_at
+
+    async def _await_shared(self, key):
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _wait_shared(self, key):
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    def _set_local(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        record_cache_event(name)
+
+
+list_cache = TieredCache(
+    max_entries=config('LOCAL_CACHE_MAX_ENTRIES', default=1024, cast=int),
+    beta=config('CACHE_EARLY_REFRESH_BETA', default=1.0, cast=float),
+)
+
+
+def list_cache_metrics():
+    """
+        Returns the size of list_cache as a metric for the /metrics endpoint; its lookups are counted per view by the
+        request metrics.
+    """
+    stats = list_cache.stats()
+    return [
+        Metric('starwars_list_cache_local_entries', 'gauge', 'Entries held by the in-process list cache.', [
+            ({}, stats['local_entries']),
+        ]),
+    ]
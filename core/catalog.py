@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.caching import CACHE_TIMEOUT, CATALOG_VERSION_KEY, aget_versions, get_versions
+from core.models import Movies, Planets
+
+
+# natural key and synced fields of every catalog model, as delivered by the Star Wars API
+CATALOG_FIELDS = {
+    Planets: ('name', ('url',)),
+    Movies: ('title', ('release_date', 'url')),
+}
+
+
+def open_snapshot(path, mode):
+    """
+        Opens an NDJSON catalog snapshot in text mode, transparently (de)compressing *.gz paths.
+    """
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def content_hash(model, record):
+    """
+        Returns a stable hash of the synced fields of a catalog record, as delivered by the source.
+    """
+    key_field, fields = CATALOG_FIELDS[model]
+    payload = json.dumps([str(record[field]) for field in (key_field,) + fields])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+@dataclass
+class UpsertResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    @property
+    def total(self):
+        return self.inserted + self.updated + self.unchanged
+
+    def describe(self, elapsed):
+        rate = self.total / elapsed if elapsed else 0
+        return '{} inserted, {} updated, {} unchanged ({:.1f} rows/sec)'.format(
+            self.inserted, self.updated, self.unchanged, rate,
+        )
+
+    def __iadd__(self, other):
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        return self
+
+
+def bulk_upsert(model, records, batch_size=500):
+    """
+        Insert or update catalog records keyed by their natural key (planet name, movie title).
+
+        Every batch is diffed against the existing rows with a single query and written with batched bulk_create and
+        bulk_update calls inside its own transaction. Every row stores the content hash of its source record; rows
+        whose hash (or, for rows written before hashes existed, synced fields) did not change are left untouched, so
+        their updated_at is not bumped.
+
+        Returns an UpsertResult with the number of rows inserted, updated and unchanged.
+    """
+    result = UpsertResult()
+    records = list(records)
+    for start in range(0, len(records), batch_size):
+        result += _upsert_batch(model, records[start:start + batch_size])
+    return result
+
+
+def _upsert_batch(model, records):
+    key_field, fields = CATALOG_FIELDS[model]
+    values = {}
+    for record in records:
+        values[record[key_field]] = {
+            field: model._meta.get_field(field).to_python(record[field]) for field in fields
+        }
+        values[record[key_field]]['content_hash'] = content_hash(model, record)
+
+    result = UpsertResult()
+    with transaction.atomic():
+        existing = {}
+        for obj in model.objects.filter(**{key_field + '__in': list(values)}):
+            existing.setdefault(getattr(obj, key_field), obj)
+
+        now = timezone.now()
+        to_create, to_update, to_rehash = [], [], []
+        for key, row in values.items():
+            obj = existing.get(key)
+            if obj is None:
+                to_create.append(model(**{key_field: key}, **row))
+            elif obj.content_hash == row['content_hash']:
+                result.unchanged += 1
+            elif any(getattr(obj, field) != row[field] for field in fields):
+                for field, value in row.items():
+                    setattr(obj, field, value)
+                obj.updated_at = now
+                to_update.append(obj)
+            else:
+                obj.content_hash = row['content_hash']
+                to_rehash.append(obj)
+                result.unchanged += 1
+
+        if to_create:
+            model.objects.bulk_create(to_create)
+        if to_update:
+            model.objects.bulk_update(to_update, list(fields) + ['content_hash', 'updated_at'])
+        if to_rehash:
+            model.objects.bulk_update(to_rehash, ['content_hash'])
+    result.inserted = len(to_create)
+    result.updated = len(to_update)
+    return result
+
+
+class CatalogNameIndex:
+    """
+        Case-folded planet name / movie title to id index of a catalog model, held in the memory of each worker.
+
+        The index is built on first use and rebuilt whenever the catalog version moves, which costs one cache read per
+        lookup. Unknown names are therefore answered without touching the database. It is also rebuilt once it is
+        CACHE_TIMEOUT seconds old, for the catalog changes whose version bump does not reach this process (a
+        process-local cache backend).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._ids = {}
+        self._version = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def _stale(self, version):
+        return version != self._version or time.monotonic() - self._built_at >= CACHE_TIMEOUT
+
+    def lookup(self, name):
+        """
+            Returns the id of the catalog row matching the name case-insensitively, or None.
+        """
+        version = get_versions(CATALOG_VERSION_KEY)[0]
+        if self._stale(version):
+            with self._lock:
+                if self._stale(version):
+                    self._ids = self._build()
+                    self._version, self._built_at = version, time.monotonic()
+        return self._ids.get(name.casefold())
+
+    async def alookup(self, name):
+        """
+            Async version of lookup(), rebuilding the index through the async ORM.
+        """
+        version = (await aget_versions(CATALOG_VERSION_KEY))[0]
+        if self._stale(version):
+            key_field = CATALOG_FIELDS[self.model][0]
+            ids = {}
+            async for pk, catalog_name in self.model.objects.order_by('id').values_list('id', key_field):
+                ids.setdefault(catalog_name.casefold(), pk)
+            self._ids, self._version, self._built_at = ids, version, time.monotonic()
+        return self._ids.get(name.casefold())
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._version = self._built_at = None
+
+    def _build(self):
+        key_field = CATALOG_FIELDS[self.model][0]
+        ids = {}
+        for pk, name in self.model.objects.order_by('id').values_list('id', key_field).iterator():
+            ids.setdefault(name.casefold(), pk)
+        return ids
+
+
+name_indexes = {model: CatalogNameIndex(model) for model in CATALOG_FIELDS}
@@ -0,0 +1,61 @@
+import json
+from datetime import date, datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def format_datetime(value):
+    """
+        Formats a datetime exactly like DjangoJSONEncoder (milliseconds, `Z` for UTC), without the encoder dispatch.
+    """
+    formatted = value.isoformat()
+    if value.microsecond:
+        formatted = formatted[:23] + formatted[26:]
+    if formatted.endswith('+00:00'):
+        formatted = formatted[:-6] + 'Z'
+    return formatted
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def fast_dumps(value):
+    """
+        Encodes a value to compact UTF-8 JSON bytes, with orjson when it is installed. Rows should carry their dates
+        already formatted, as done by the list row builders, so the encoder never calls back into Python.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=json_default).encode()
+
+
+def django_dumps(value):
+    """
+        Encodes a value like JsonResponse does.
+    """
+    return json.dumps(value, cls=DjangoJSONEncoder).encode()
+
+
+@lru_cache(maxsize=None)
+def get_dumps():
+    """
+        Returns the encoder of the list responses, selected by the JSON_ENCODER setting.
+    """
+    return import_string(settings.JSON_ENCODER)
+
+
+def dumps(value):
+    return get_dumps()(value)
@@ -0,0 +1,397 @@
+import atexit
+import sys
+import threading
+from collections import Counter
+
+from decouple import config
+from django.db import DatabaseError, models, transaction
+from django.db.models.functions import Coalesce, Greatest
+
+from core.bitsets import SparseBitset
+from core.caching import bump_version, favorites_version_key, get_versions, key_part, list_cache, list_versions
+from core.models import FavoriteMovies, FavoritePlanets, Movies, Planets
+from starwars.logger import Logger
+from starwars.metrics import Metric
+
+logger = Logger()
+
+# maximum number of items accepted by the batch favorite endpoints
+FAVORITE_BATCH_LIMIT = config('FAVORITE_BATCH_LIMIT', default=100, cast=int)
+
+# maximum number of rows returned by the top favorites endpoints
+TOP_FAVORITES_LIMIT = config('TOP_FAVORITES_LIMIT', default=100, cast=int)
+
+# write-behind of the added favorites, see FavoriteBuffer
+FAVORITE_WRITE_BEHIND = config('FAVORITE_WRITE_BEHIND', default=False, cast=bool)
+FAVORITE_FLUSH_SIZE = config('FAVORITE_FLUSH_SIZE', default=500, cast=int)
+FAVORITE_FLUSH_INTERVAL = config('FAVORITE_FLUSH_INTERVAL', default=1.0, cast=float)
+
+# favorite model, catalog foreign key and custom name field of every catalog model
+FAVORITE_FIELDS = {
+    Planets: (FavoritePlanets, 'planet_id', 'custom_name'),
+    Movies: (FavoriteMovies, 'movie_id', 'custom_title'),
+}
+
+
+class FavoriteSet(SparseBitset):
+    """
+        The favorites of a user for one catalog model: a SparseBitset of their catalog ids, with the custom names of the
+        ones that have one. Marking a row as a favorite is a bit test or a binary search, however many rows are marked.
+
+        A FavoriteSet is cached and shared between requests: it is never modified once built, added() returns a copy.
+    """
+
+    __slots__ = ('custom_names',)
+
+    def __init__(self, favorites=()):
+        """
+            favorites is an iterable of (catalog id, custom name) pairs.
+        """
+        super().__init__()
+        self.custom_names = {}
+        catalog_ids = []
+        for catalog_id, custom_name in favorites:
+            catalog_ids.append(catalog_id)
+            if custom_name:
+                self.custom_names[catalog_id] = custom_name
+        self.update(catalog_ids)
+
+    def get(self, catalog_id):
+        """
+            Returns the custom name of a favorite, None when it has none or is not a favorite.
+        """
+        return self.custom_names.get(catalog_id)
+
+    def added(self, entries):
+        """
+            Returns a copy of the set with the given {catalog id: custom name} favorites.
+        """
+        favorites = self.copy()
+        favorites.custom_names = dict(self.custom_names)
+        favorites.update(entries)
+        for catalog_id, custom_name in entries.items():
+            if custom_name:
+                favorites.custom_names[catalog_id] = custom_name
+            else:
+                favorites.custom_names.pop(catalog_id, None)
+        return favorites
+
+    def nbytes(self):
+        """
+            Returns the approximate number of bytes held by the set, custom names included.
+        """
+        return super().nbytes() + sys.getsizeof(self.custom_names) + sum(
+            sys.getsizeof(catalog_id) + sys.getsizeof(custom_name)
+            for catalog_id, custom_name in self.custom_names.items()
+        )
+
+
+def favorites_key(model, user_id, version):
+    return f'favorite_{model._meta.model_name}:{key_part(user_id)}:{version}'
+
+
+def get_favorites(model, user_id, version):
+    """
+        Returns the favorites of a user for the given catalog model as a FavoriteSet, cached per user under the given
+        favorites version. Anonymous requests have no favorites. Favorites still waiting in the write-behind buffer
+        are included.
+    """
+    if not user_id:
+        return FavoriteSet()
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+    favorites = list_cache.get_or_set(
+        favorites_key(model, user_id, version),
+        lambda: FavoriteSet(favorite_model.objects.filter(user_id=user_id).values_list(id_field, name_field)),
+    )
+    return favorite_buffer.overlay(model, user_id, favorites)
+
+
+async def aget_favorites(model, user_id, version):
+    if not user_id:
+        return FavoriteSet()
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+
+    async def load():
+        favorites = favorite_model.objects.filter(user_id=user_id).values_list(id_field, name_field)
+        return FavoriteSet([favorite async for favorite in favorites])
+
+    favorites = await list_cache.aget_or_set(favorites_key(model, user_id, version), load)
+    return favorite_buffer.overlay(model, user_id, favorites)
+
+
+def favorites_added(model, user_id, entries):
+    """
+        Moves the favorites version of a user forward once the given {catalog id: custom name} favorites are written.
+
+        The favorites cached under the previous version are cached again under the new one with the new favorites
+        set, so the next list request does not load them again. They are left to be loaded when another write moved
+        the version in between, as they may miss its favorites.
+    """
+    version_key = favorites_version_key(model, user_id)
+    version = get_versions(version_key)[0]
+    favorites = list_cache.get(favorites_key(model, user_id, version))
+    new_version = bump_version(version_key)
+    if favorites is not None and new_version == version + 1:
+        list_cache.set(favorites_key(model, user_id, new_version), favorites.added(entries))
+
+
+def insert_favorites(model, favorites, batch_size=None):
+    """
+        Inserts the (user id, catalog id, custom name) favorites of the given catalog model that do not exist yet, with
+        one query finding the existing ones and one bulk insert, counts them with count_favorites() and returns them.
+
+        Meant to run in a transaction: SQLite transactions take the write lock up front (see starwars.sqlite), so no
+        favorite can be added by another connection between the check and the insert, and the counts stay exact.
+    """
+    if not favorites:
+        return []
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+    existing = favorite_model.objects.filter(
+        user_id__in={user_id for user_id, catalog_id, custom_name in favorites},
+        **{id_field + '__in': {catalog_id for user_id, catalog_id, custom_name in favorites}},
+    ).values_list('user_id', id_field)
+    # user ids come from requests, as strings or integers
+    existing = {(str(user_id), catalog_id) for user_id, catalog_id in existing}
+    created = [favorite for favorite in favorites if (str(favorite[0]), favorite[1]) not in existing]
+    favorite_model.objects.bulk_create(
+        [
+            favorite_model(**{'user_id': user_id, id_field: catalog_id, name_field: custom_name})
+            for user_id, catalog_id, custom_name in created
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    count_favorites(model, [catalog_id for user_id, catalog_id, custom_name in created])
+    return created
+
+
+def count_favorites(model, catalog_ids, step=1):
+    """
+        Adds new favorites to the favorite_count of their catalog rows, given the catalog id of every new favorite, or
+        removes deleted ones with a step of -1. The counts are updated in the database, with one UPDATE per distinct
+        change, and never go below 0.
+    """
+    catalog_ids_by_change = {}
+    for catalog_id, count in Counter(catalog_ids).items():
+        catalog_ids_by_change.setdefault(count * step, []).append(catalog_id)
+    for change, ids in catalog_ids_by_change.items():
+        count = models.F('favorite_count') + change
+        model.objects.filter(id__in=ids).update(favorite_count=Greatest(count, 0) if change < 0 else count)
+
+
+def reconcile_favorite_counts(model, batch_size=10000):
+    """
+        Recounts the favorites of every catalog row of the given model and fixes the counts found wrong, one range of
+        `batch_size` ids per transaction. Returns the number of rows fixed.
+
+        Favorites written without count_favorites() or the signals of core.signals, like the ones of
+        generate_fixtures, are only counted this way.
+    """
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+    favorites = favorite_model.objects.filter(**{id_field: models.OuterRef('pk')})
+    count = Coalesce(models.Subquery(
+        favorites.values(id_field).annotate(count=models.Count('id')).values('count'),
+    ), 0)
+    bounds = model.objects.aggregate(low=models.Min('id'), high=models.Max('id'))
+    if bounds['low'] is None:
+        return 0
+    fixed = 0
+    for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+        with transaction.atomic():
+            rows = model.objects.filter(id__gte=start, id__lt=start + batch_size).exclude(favorite_count=count)
+            fixed += rows.update(favorite_count=count)
+    return fixed
+
+
+def favorite_set_stats():
+    """
+        Returns the number of favorite sets held by the in-process list cache, one per user and catalog model, and the
+        total and largest number of bytes they use.
+    """
+    sizes = [value.nbytes() for value in list_cache.local_values() if isinstance(value, FavoriteSet)]
+    return {'entries': len(sizes), 'bytes': sum(sizes), 'max_bytes': max(sizes, default=0)}
+
+
+def favorite_set_metrics():
+    """
+        Returns favorite_set_stats() as metrics for the /metrics endpoint.
+    """
+    stats = favorite_set_stats()
+    return [
+        Metric('starwars_favorite_sets', 'gauge', 'Favorite sets held by the in-process list cache.', [
+            ({}, stats['entries']),
+        ]),
+        Metric('starwars_favorite_set_bytes', 'gauge', 'Bytes used by the favorite sets of the list cache.', [
+            ({'stat': 'total'}, stats['bytes']),
+            ({'stat': 'max'}, stats['max_bytes']),
+        ]),
+    ]
+
+
+def matches_custom_name(favorites, query):
+    """
+        Tells whether a search would match the custom name of one of the given favorites.
+    """
+    query = query.lower()
+    return any(query in custom_name.lower() for custom_name in favorites.custom_names.values())
+
+
+def overlay_favorites(rows, favorites, name_field):
+    """
+        Merges a user's FavoriteSet onto the rows of a shared catalog page: favorites are flagged and shown under their
+        custom name. The catalog id used for the merge is not part of the returned rows.
+    """
+    results = []
+    custom_names = favorites.custom_names
+    for row in rows:
+        row = dict(row)
+        pk = row.pop('id')
+        row['is_favourite'] = pk in favorites
+        if pk in custom_names:
+            row[name_field] = custom_names[pk]
+        results.append(row)
+    return results
+
+
+class FavoriteBuffer:
+    """
+        Write-behind buffer of the favorites added by this process.
+
+        Whether an added favorite is new is answered from the user's favorites as loaded by get_favorites() and from
+        the favorites still waiting in the buffer. Waiting favorites are written with one bulk insert per favorite
+        model, in a single transaction: as soon as `flush_size` of them wait, at most `flush_interval` seconds after
+        they were added (0 disables the timer) and when the process exits. Until then list pages show them through
+        get_favorites(); searches by custom name find them once written.
+
+        A flush failing on a database error is retried with the next one. The unique constraints turn favorites added
+        by several processes at once into no-ops.
+    """
+
+    def __init__(self, enabled, flush_size, flush_interval):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # {(catalog model, user id): {catalog id: custom name}}
+        self._pending = {}
+        self._flushing = {}
+        self._size = 0
+        # incremented whenever written favorites leave the buffer, see add()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, model, user_id, entries):
+        """
+            Queues the {catalog id: custom name} favorites of a user and returns the set of catalog ids that were not
+            favorites yet. The others are left untouched.
+        """
+        key = (model, str(user_id))
+        while True:
+            generation = self._generation
+            committed = get_favorites(model, user_id, list_versions(model, user_id)[1])
+            with self._lock:
+                # favorites written since `committed` was read may be missing from both: read them again
+                if generation != self._generation:
+                    continue
+                pending = self._pending.setdefault(key, {})
+                created = set()
+                for catalog_id, custom_name in entries.items():
+                    if catalog_id in committed or catalog_id in pending:
+                        continue
+                    pending[catalog_id] = custom_name
+                    created.add(catalog_id)
+                if not pending:
+                    del self._pending[key]
+                self._size += len(created)
+                full = self._size >= self.flush_size
+                if self.flush_interval > 0 and not self._stopped and not self._flusher_alive():
+                    self._thread = threading.Thread(target=self._run, name='favorite-buffer', daemon=True)
+                    self._thread.start()
+                timed = self._thread is not None and self._thread.is_alive()
+            break
+        if full:
+            if timed:
+                self._wake.set()
+            else:
+                self.flush()
+        return created
+
+    def overlay(self, model, user_id, favorites):
+        """
+            Returns the favorites of a user with the ones still waiting in the buffer.
+        """
+        key = (model, str(user_id))
+        if key not in self._pending and key not in self._flushing:
+            return favorites
+        with self._lock:
+            waiting = {**self._flushing.get(key, {}), **self._pending.get(key, {})}
+        return favorites.added(waiting)
+
+    def flush(self):
+        """
+            Writes the waiting favorites, and returns their number.
+        """
+        with self._flush_lock:
+            with self._lock:
+                flushing, self._pending, self._size = self._pending, {}, 0
+                self._flushing = flushing
+            if not flushing:
+                return 0
+            favorites = {}
+            for (model, user_id), entries in flushing.items():
+                favorites.setdefault(model, []).extend(
+                    (user_id, catalog_id, custom_name) for catalog_id, custom_name in entries.items()
+                )
+            count = sum(len(rows) for rows in favorites.values())
+            # favorites already written by another process are skipped, with their custom name
+            inserted = {}
+            try:
+                with transaction.atomic():
+                    for model, rows in favorites.items():
+                        for user_id, catalog_id, custom_name in insert_favorites(model, rows, self.flush_size):
+                            inserted.setdefault((model, user_id), {})[catalog_id] = custom_name
+            except DatabaseError:
+                logger.error(msg='Writing {} buffered favorites failed, retrying with the next flush'.format(count))
+                with self._lock:
+                    for key, entries in flushing.items():
+                        self._pending[key] = {**entries, **self._pending.get(key, {})}
+                    self._size = sum(len(entries) for entries in self._pending.values())
+                    self._flushing = {}
+                return 0
+
+            for (model, user_id), entries in inserted.items():
+                favorites_added(model, user_id, entries)
+            with self._lock:
+                self._flushing = {}
+                self._generation += 1
+            logger.info(msg='{} buffered favorites written'.format(count))
+            return count
+
+    def close(self):
+        """
+            Stops the flush timer and writes the waiting favorites.
+        """
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _flusher_alive(self):
+        # a thread started before fork() does not run in the child
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+favorite_buffer = FavoriteBuffer(FAVORITE_WRITE_BEHIND, FAVORITE_FLUSH_SIZE, FAVORITE_FLUSH_INTERVAL)
+
+# pending favorites are written when the process exits, including gunicorn workers shut down gracefully
+atexit.register(favorite_buffer.close)
@@ -0,0 +1,215 @@
+import math
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FetchError(Exception):
+    pass
+
+
+# one fetched page of a feed; `results` is None when the source answered 304 Not Modified and `page_count` is None
+# when the feed is walked through its `next` links
+Page = namedtuple('Page', ['feed', 'number', 'page_count', 'url', 'results', 'etag', 'last_modified'])
+
+_DONE = object()
+
+
+def page_url(url, page):
+    """
+        Returns the given feed url pointing at the given page number.
+    """
+    if page == 1:
+        return url
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class CatalogFetcher:
+    """
+        Fetches paginated Star Wars API feeds over a shared, pooled session.
+
+        Every feed is walked by its own coordinator thread. Once the first page of a feed tells how many pages there
+        are, the remaining pages are prefetched concurrently on a bounded worker pool; feeds without a count fall back
+        to following their `next` links. Fetched pages are handed to the consumer through a bounded queue, so the
+        caller can write page N to the database while further pages are still in flight.
+
+        Requests failing with a 5xx status, a timeout or a connection error are retried with exponential backoff.
+        When validators of a previous fetch are given, pages are requested conditionally with If-None-Match /
+        If-Modified-Since.
+    """
+
+    def __init__(self, workers=4, retries=3, backoff=0.5, timeout=10):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='catalog-fetch')
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+    def get(self, url, etag=None, last_modified=None):
+        """
+            GETs the given url, conditionally when validators are given, and returns the 200 or 304 response.
+            Retries transient failures and raises FetchError on anything else.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as error:
+                failure = error
+            else:
+                if response.status_code == 200 or (response.status_code == 304 and headers):
+                    return response
+                if response.status_code < 500:
+                    raise FetchError('{} returned {}'.format(url, response.status_code))
+                failure = FetchError('{} returned {}'.format(url, response.status_code))
+            if attempt >= self.retries or self._stopped.is_set():
+                raise FetchError('giving up on {} after {} attempts: {}'.format(url, attempt + 1, failure))
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def stream(self, feeds, validators=None, page_counts=None, resume=None):
+        """
+            Fetches all the given feeds in parallel.
+
+            `feeds` maps an arbitrary feed key to the url of its first page. Yields a Page for every fetched page, in
+            the order pages arrive. Raises FetchError as soon as one page of any feed cannot be fetched.
+
+            `validators` optionally maps page urls to the {'etag', 'last_modified'} of a previous fetch; those pages
+            are requested conditionally. `page_counts` maps a feed to its page count in a previous run, which is
+            trusted when the first page is not modified. `resume` maps a feed to the page to start from instead of
+            the first one, for feeds with a known page count.
+        """
+        validators = validators or {}
+        page_counts = page_counts or {}
+        resume = resume or {}
+        pages = queue.Queue(maxsize=self.workers * 2)
+        coordinators = [
+            threading.Thread(
+                target=self._walk_feed,
+                args=(feed, url, validators, page_counts.get(feed), resume.get(feed), pages),
+                daemon=True,
+            )
+            for feed, url in feeds.items()
+        ]
+        for coordinator in coordinators:
+            coordinator.start()
+
+        running = len(coordinators)
+        try:
+            while running:
+                page = pages.get()
+                if page is _DONE:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            if running:
+                self._stopped.set()
+                # unblock coordinators waiting on a full queue so they can notice the stop flag
+                while any(coordinator.is_alive() for coordinator in coordinators):
+                    try:
+                        pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+    def _fetch_page(self, feed, url, number, page_count, validators):
+        page = page_url(url, number)
+        response = self.get(page, **validators.get(page, {}))
+        data = response.json() if response.status_code == 200 else None
+        if number == 1 and data is not None:
+            count, per_page = data.get('count'), len(data['results'])
+            if not data.get('next'):
+                page_count = 1
+            elif count and per_page:
+                page_count = math.ceil(count / per_page)
+            else:
+                page_count = None
+        return Page(
+            feed=feed,
+            number=number,
+            page_count=page_count,
+            url=page,
+            results=data['results'] if data is not None else None,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        ), data
+
+    def _walk_feed(self, feed, url, validators, page_count, first_page, pages):
+        try:
+            if not (first_page and page_count):
+                first, data = self._fetch_page(feed, url, 1, page_count, validators)
+                if first.results is None and not page_count:
+                    # not modified, but nothing tells how many pages follow: fetch it again in full
+                    first, data = self._fetch_page(feed, url, 1, None, {})
+                self._put(pages, first)
+                if first.page_count is None:
+                    self._follow_next(feed, data.get('next'), pages)
+                    return
+                page_count, first_page = first.page_count, 2
+            futures = [
+                self._executor.submit(self._fetch_page, feed, url, number, page_count, validators)
+                for number in range(first_page, page_count + 1)
+            ]
+            for future in as_completed(futures):
+                self._put(pages, future.result()[0])
+        except Exception as error:
+            self._put(pages, error)
+        finally:
+            self._put(pages, _DONE)
+
+    def _follow_next(self, feed, next_url, pages):
+        number = 1
+        while next_url and not self._stopped.is_set():
+            number += 1
+            response = self.get(next_url)
+            data = response.json()
+            self._put(pages, Page(
+                feed=feed,
+                number=number,
+                page_count=None,
+                url=next_url,
+                results=data['results'],
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            ))
+            next_url = data.get('next')
+
+    def _put(self, pages, item):
+        while not self._stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -0,0 +1,82 @@
+import datetime
+import random
+from itertools import islice
+
+SYLLABLES = (
+    'al', 'an', 'ba', 'cor', 'da', 'do', 'en', 'ga', 'ho', 'ith', 'ja', 'ka', 'ku', 'lo', 'ma', 'na', 'no', 'or',
+    'pa', 'ra', 'ro', 'sa', 'ta', 'tu', 'u', 'va', 'wa', 'ya', 'zo',
+)
+
+
+def skewed_index(rng, count, skew):
+    """
+        Draws an index in [0, count) with a probability decreasing like (index + 1) ** -skew, index 0 being the most
+        likely (a continuous Zipf approximation, sampled in constant time). A skew of 0 draws uniformly.
+    """
+    if skew == 0:
+        return rng.randrange(count)
+    if skew == 1:
+        rank = (count + 1) ** rng.random()
+    else:
+        rank = (1 + rng.random() * ((count + 1) ** (1 - skew) - 1)) ** (1 / (1 - skew))
+    return min(int(rank) - 1, count - 1)
+
+
+def skewed_counts(total, count, skew):
+    """
+        Splits `total` over `count` buckets proportionally to (index + 1) ** -skew, yielding the share of every bucket
+        in order. The shares add up to `total` exactly.
+    """
+    weights_sum = sum((index + 1) ** -skew for index in range(count))
+    assigned = expected = 0
+    for index in range(count):
+        expected += total * (index + 1) ** -skew / weights_sum
+        share = round(expected) - assigned
+        assigned += share
+        yield share
+
+
+def fake_name(rng, number):
+    """
+        Returns a pronounceable, unique name for the generated catalog row with the given number.
+    """
+    word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return '{} {}'.format(word.capitalize(), number)
+
+
+def fake_date(rng, start=datetime.date(1977, 5, 25), days=20000):
+    return start + datetime.timedelta(days=rng.randrange(days))
+
+
+def distinct_picks(rng, count, population, skew):
+    """
+        Returns `count` distinct indexes in [0, population), favoring the low ones according to the skew.
+    """
+    if count * 2 >= population:
+        return rng.sample(range(population), count)
+    picks = set()
+    # popular indexes come back often with a strong skew, fill up uniformly once skewed draws stop adding new ones
+    for _ in range(count * 4):
+        picks.add(skewed_index(rng, population, skew))
+        if len(picks) == count:
+            return sorted(picks)
+    while len(picks) < count:
+        picks.add(rng.randrange(population))
+    return sorted(picks)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def seeded_random(seed, stream):
+    """
+        Returns a random generator dedicated to one kind of generated rows, so changing the volume of one kind does not
+        change the rows generated for the others.
+    """
+    return random.Random('{}:{}'.format(seed, stream))
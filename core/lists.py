@@ -0,0 +1,140 @@
+from django.db import models
+from django.http import HttpResponse
+
+from core.caching import key_part
+from core.encoding import dumps, format_datetime
+from core.favorites import FavoriteSet, overlay_favorites
+from core.models import FavoriteMovies, FavoritePlanets, Movies, Planets
+from core.pagination import page_cache_key, page_link
+from core.search import contains
+
+
+def planet_queryset(query):
+    """
+        Returns the catalog planets matching the search, shared by all users.
+    """
+    planets = Planets.objects.all()
+    if query:
+        planets = planets.filter(contains(Planets, query))
+    return planets
+
+
+def user_planet_queryset(user_id, query):
+    """
+        Returns the planets matching the search by name or by the custom name the user gave them, a planet once however
+        many users favorited it. Their rows are marked with the user's favorites by build_page().
+    """
+    matching_favourites = FavoritePlanets.objects.filter(contains(FavoritePlanets, query), user_id=user_id)
+    return Planets.objects.filter(contains(Planets, query) | models.Q(id__in=matching_favourites.values('planet_id')))
+
+
+def planet_row(planet):
+    return {
+        'id': planet.id,
+        'name': planet.name,
+        'created_at': format_datetime(planet.created_at),
+        'updated_at': format_datetime(planet.updated_at),
+        'url': planet.url,
+    }
+
+
+def movie_queryset(query):
+    """
+        Returns the catalog movies matching the search, shared by all users.
+    """
+    movies = Movies.objects.all()
+    if query:
+        movies = movies.filter(contains(Movies, query))
+    return movies
+
+
+def user_movie_queryset(user_id, query):
+    """
+        Returns the movies matching the search by title or by the custom title the user gave them, one row per movie.
+    """
+    matching_favorites = FavoriteMovies.objects.filter(contains(FavoriteMovies, query), user_id=user_id)
+    return Movies.objects.filter(contains(Movies, query) | models.Q(id__in=matching_favorites.values('movie_id')))
+
+
+def movie_row(movie):
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'release_date': movie.release_date.isoformat(),
+        'created_at': format_datetime(movie.created_at),
+        'updated_at': format_datetime(movie.updated_at),
+        'url': movie.url,
+    }
+
+
+def top_queryset(model, limit):
+    """
+        Returns the `limit` catalog rows of the model with the most favorites, read backwards from the index on
+        (favorite_count, id). Rows nobody has as a favorite are left out.
+    """
+    return model.objects.filter(favorite_count__gt=0).order_by('-favorite_count', '-id')[:limit]
+
+
+def top_row(obj, row):
+    result = row(obj)
+    del result['id']
+    result['favorite_count'] = obj.favorite_count
+    return result
+
+
+def catalog_page_key(request, model, catalog_version, query):
+    return f'{model._meta.model_name}:{catalog_version}:{key_part(query)}:{key_part(page_cache_key(request))}'
+
+
+def user_page_key(request, model, user_id, catalog_version, favorites_version, query):
+    return (
+        f'{model._meta.model_name}:{key_part(user_id)}:{catalog_version}:{favorites_version}:{key_part(query)}:'
+        f'{key_part(page_cache_key(request))}'
+    )
+
+
+def build_page(rows, next_params, count, row, name_field, favorites=None):
+    """
+        Returns the cacheable form of a list page: the query parameters of the next page, the total count (None unless
+        counted) and the rows serialized with `row` and encoded to JSON one by one, so a cached page is served without
+        encoding it again. Favorites are renamed on `name_field`.
+
+        The pages of a user pass the user's favorites, their rows are encoded as seen by that user. Catalog pages,
+        shared by all users, are encoded as seen by a user without favorites, and their rows also kept as dicts for
+        overlay_fragments().
+    """
+    results = [row(obj) for obj in rows]
+    page = {'next': next_params, 'count': count}
+    if favorites is None:
+        page['results'] = results
+        favorites = FavoriteSet()
+    results = overlay_favorites(results, favorites, name_field)
+    page['fragments'] = [dumps(result) for result in results]
+    return page
+
+
+def overlay_fragments(page, favorites, name_field):
+    """
+        Returns the encoded rows of a catalog page as seen by a user with the given favorites: only the rows of the
+        user's favorites are encoded again.
+    """
+    fragments = page['fragments']
+    if not favorites:
+        return fragments
+    fragments = list(fragments)
+    for index, result in enumerate(page['results']):
+        if result['id'] in favorites:
+            fragments[index] = dumps(overlay_favorites([result], favorites, name_field)[0])
+    return fragments
+
+
+def list_response(request, view_name, page, fragments):
+    """
+        Returns the response of a list view, made of the encoded rows of the page and of its next page link.
+    """
+    head = {'next_page': page_link(request, view_name, page['next'])}
+    if page['count'] is not None:
+        head['count'] = page['count']
+    # the encoded head minus its closing brace, followed by the already encoded rows
+    body = dumps(head)[:-1] + b',"results":[' + b','.join(fragments) + b']}'
+    return HttpResponse(body, content_type='application/json')
@@ -0,0 +1,184 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from core.benchmark import (
+    endpoint_name, parse_metrics, parse_mix, read_traffic, regressions, summarize, synthetic_traffic,
+)
+from core.models import Movies, Planets
+from starwars.metrics import metrics
+
+
+class Command(BaseCommand):
+    help = 'Replays recorded or synthetic traffic against the API and reports latency percentiles per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--replay',
+            help='NDJSON traffic file to replay, one {"method", "path", "params", "data"} object per line',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help='Number of synthetic requests',
+        )
+        parser.add_argument(
+            '--mix',
+            type=parse_mix,
+            default=None,
+            help='Weights of the synthetic requests, e.g. list=60,search=30,favorite=10',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100,
+            help='Number of distinct users of the synthetic requests',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Seed of the synthetic requests, for reproducible runs',
+        )
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server (e.g. http://localhost:8000); requests go through the Django test '
+                 'client in this process when omitted',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Number of requests in flight',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=0,
+            help='Number of requests sent before measuring (the first ones of a replayed traffic)',
+        )
+        parser.add_argument('--output', help='File the results are written to as JSON')
+        parser.add_argument('--baseline', help='Results of a previous run to compare with')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Fail when the p95 latency or the throughput of an endpoint regresses by more than this fraction of '
+                 'the baseline',
+        )
+
+    def handle(self, *args, **options):
+        calls = self.load_calls(options)
+        if len(calls) <= options['warmup']:
+            raise CommandError('No requests to measure')
+        send = self.remote_sender(options['url']) if options['url'] else self.local_sender()
+        read_metrics = self.remote_metrics(options['url']) if options['url'] else metrics.render
+
+        warmup, calls = calls[:options['warmup']], calls[options['warmup']:]
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            # without concurrency requests are sent from this thread
+            send_all = executor.map if options['concurrency'] > 1 else map
+            list(send_all(send, warmup))
+            before = parse_metrics(read_metrics())
+            started = time.perf_counter()
+            timings = list(send_all(send, calls))
+            elapsed = time.perf_counter() - started
+            after = parse_metrics(read_metrics())
+
+        results = summarize(timings, elapsed, before, after)
+        results.update({
+            'mode': 'url' if options['url'] else 'in-process',
+            'traffic': options['replay'] or 'synthetic',
+            'concurrency': options['concurrency'],
+            'seed': options['seed'],
+        })
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write('Results written to {}'.format(options['output']))
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                found = regressions(results, json.load(baseline), options['threshold'])
+            if found:
+                raise CommandError('Regressions over {:.0%}:\n{}'.format(options['threshold'], '\n'.join(found)))
+            self.stdout.write('No regression over {:.0%}'.format(options['threshold']))
+
+    def load_calls(self, options):
+        if options['replay']:
+            try:
+                return read_traffic(options['replay'])
+            except (OSError, ValueError) as error:
+                raise CommandError(str(error))
+        planets = list(Planets.objects.values_list('name', flat=True))
+        movies = list(Movies.objects.values_list('title', flat=True))
+        if not planets and not movies:
+            raise CommandError('The catalog is empty, run load_data or generate_fixtures first')
+        count = options['requests'] + options['warmup']
+        return synthetic_traffic(count, planets, movies, options['mix'], options['users'], options['seed'])
+
+    @staticmethod
+    def local_sender():
+        clients = threading.local()
+
+        def send(call):
+            client = getattr(clients, 'client', None)
+            if client is None:
+                client = clients.client = Client(HTTP_HOST='localhost')
+            started = time.perf_counter()
+            if call.method == 'GET':
+                response = client.get(call.path, call.params)
+            else:
+                response = client.generic(call.method, call.path + _query(call.params), json.dumps(call.data or {}),
+                                          content_type='application/json')
+            return endpoint_name(call.path), response.status_code, time.perf_counter() - started
+        return send
+
+    @staticmethod
+    def remote_sender(url):
+        def send(call):
+            body = json.dumps(call.data).encode() if call.data is not None else None
+            request = Request(url.rstrip('/') + call.path + _query(call.params), data=body, method=call.method,
+                              headers={'Content-Type': 'application/json'})
+            started = time.perf_counter()
+            try:
+                with urlopen(request) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as error:
+                status = error.code
+            return endpoint_name(call.path), status, time.perf_counter() - started
+        return send
+
+    @staticmethod
+    def remote_metrics(url):
+        def read():
+            with urlopen(url.rstrip('/') + '/metrics') as response:
+                return response.read().decode()
+        return read
+
+    def report(self, results):
+        for endpoint, result in results['endpoints'].items():
+            self.stdout.write(
+                '{}: {} requests ({} errors), {}/s, p50 {}ms, p95 {}ms, p99 {}ms, {} queries/request, '
+                'cache hit ratio {}'.format(
+                    endpoint, result['requests'], result['errors'], result['throughput'], result['p50_ms'],
+                    result['p95_ms'], result['p99_ms'], result['queries_per_request'], result['cache_hit_ratio'],
+                )
+            )
+        self.stdout.write('Total: {} requests in {}s, {}/s, cache hit ratio {}'.format(
+            results['requests'], results['elapsed'], results['throughput'], results['cache_hit_ratio'],
+        ))
+
+
+def _query(params):
+    return '?' + urlencode(params) if params else ''
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.catalog import CATALOG_FIELDS, open_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Exports the movies and planets catalog as an NDJSON snapshot (gzip compressed for *.gz paths)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File the snapshot is written to')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of rows fetched from the database at a time',
+        )
+
+    def handle(self, *args, **options):
+        with open_snapshot(options['path'], 'wt') as snapshot:
+            for model, (key_field, fields) in CATALOG_FIELDS.items():
+                label = model._meta.label_lower
+                columns = (key_field,) + fields
+                exported = 0
+                rows = model.objects.order_by('id').values_list(*columns).iterator(chunk_size=options['chunk_size'])
+                for row in rows:
+                    record = {column: str(value) for column, value in zip(columns, row)}
+                    snapshot.write(json.dumps({'model': label, 'fields': record}) + '\n')
+                    exported += 1
+                self.stdout.write('{}: {} exported'.format(model.__name__, exported))
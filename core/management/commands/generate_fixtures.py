@@ -0,0 +1,159 @@
+import time
+from array import array
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from core.caching import bump_existing_versions, catalog_changed, favorites_version_key
+from core.favorites import reconcile_favorite_counts
+from core.fixtures import batches, distinct_picks, fake_date, fake_name, seeded_random, skewed_counts
+from core.models import FavoriteMovies, FavoritePlanets, Movies, Planets
+
+
+class Command(BaseCommand):
+    help = 'Fills the catalog and the favorites with generated rows, for scale testing and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--planets', type=int, default=10000, help='Number of planets generated')
+        parser.add_argument('--movies', type=int, default=1000, help='Number of movies generated')
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10000,
+            help='Number of users the favorites are spread over, with ids 1 to N',
+        )
+        parser.add_argument(
+            '--favorite-planets',
+            type=int,
+            default=100000,
+            help='Number of favorite planets generated',
+        )
+        parser.add_argument(
+            '--favorite-movies',
+            type=int,
+            default=10000,
+            help='Number of favorite movies generated',
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.0,
+            help='Zipf exponent of the favorites: how much the first users have more favorites than the others, and '
+                 'the first catalog rows are more often favorites (0 spreads them uniformly)',
+        )
+        parser.add_argument(
+            '--custom-name-ratio',
+            type=float,
+            default=0.2,
+            help='Share of the favorites given a custom name',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of rows inserted per query',
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.insert(Planets, ('name', 'url', 'content_hash'), self.planets(options['planets'], options['seed']))
+        self.insert(
+            Movies,
+            ('title', 'release_date', 'url', 'content_hash'),
+            self.movies(options['movies'], options['seed']),
+        )
+        # favorites a user already had are skipped
+        self.insert(
+            FavoritePlanets,
+            ('user_id', 'planet', 'custom_name'),
+            self.favorites(FavoritePlanets, Planets, options['favorite_planets'], options),
+            ignore_conflicts=True,
+        )
+        self.insert(
+            FavoriteMovies,
+            ('user_id', 'movie', 'custom_title'),
+            self.favorites(FavoriteMovies, Movies, options['favorite_movies'], options),
+            ignore_conflicts=True,
+        )
+
+        # bulk inserts send no signals: count the favorites, and retire the cached pages and the cached favorites of
+        # the users, through versions shared with the running servers
+        for model in (Planets, Movies):
+            reconcile_favorite_counts(model)
+        catalog_changed()
+        for model in (Planets, Movies):
+            for user_ids in batches(range(1, options['users'] + 1), 1000):
+                bump_existing_versions([favorites_version_key(model, user_id) for user_id in user_ids])
+
+    @staticmethod
+    def planets(count, seed):
+        rng = seeded_random(seed, 'planets')
+        for number in range(1, count + 1):
+            yield fake_name(rng, number), 'https://swapi.dev/api/planets/generated/{}/{}/'.format(seed, number), ''
+
+    @staticmethod
+    def movies(count, seed):
+        rng = seeded_random(seed, 'movies')
+        for number in range(1, count + 1):
+            yield (
+                fake_name(rng, number),
+                fake_date(rng).isoformat(),
+                'https://swapi.dev/api/films/generated/{}/{}/'.format(seed, number),
+                '',
+            )
+
+    def favorites(self, favorite_model, model, total, options):
+        """
+            Yields `total` (user id, catalog id, custom name) favorites spread over the users, and over the catalog rows
+            of the given model, following the skew. A user never gets the same catalog row twice.
+        """
+        if not total:
+            return
+        # catalog ids are held in a compact array, the favorites themselves are streamed
+        catalog_ids = array('q', model.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+        if not catalog_ids:
+            raise CommandError('No {} to generate favorites for'.format(model.__name__.lower()))
+        if total > len(catalog_ids) * options['users']:
+            raise CommandError('Cannot generate {} distinct favorites for {} users and {} {}'.format(
+                total, options['users'], len(catalog_ids), model.__name__.lower(),
+            ))
+        rng = seeded_random(options['seed'], favorite_model._meta.model_name)
+        ratio = options['custom_name_ratio']
+        carried = 0
+        for user_id, share in enumerate(skewed_counts(total, options['users'], options['skew']), start=1):
+            # a user cannot have more favorites than there are catalog rows: the excess goes to the next users
+            count = min(share + carried, len(catalog_ids))
+            carried += share - count
+            for index in distinct_picks(rng, count, len(catalog_ids), options['skew']):
+                custom_name = 'My ' + fake_name(rng, index + 1) if rng.random() < ratio else None
+                yield user_id, catalog_ids[index], custom_name
+
+    def insert(self, model, fields, rows, ignore_conflicts=False):
+        """
+            Inserts the rows, tuples of values of the given fields, in batches of plain INSERT statements: going
+            through model instances and bulk_create() would cost more than the inserts themselves. Both timestamps are
+            set to the time of the run.
+        """
+        on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+        columns = [model._meta.get_field(field).column for field in fields + ('created_at', 'updated_at')]
+        sql = '{} {} ({}) VALUES ({}) {}'.format(
+            connection.ops.insert_statement(on_conflict=on_conflict),
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns),
+            ', '.join(['%s'] * len(columns)),
+            connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None),
+        )
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        started = time.monotonic()
+        inserted = 0
+        for batch in batches(rows, self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, [row + (now, now) for row in batch])
+            inserted += len(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write('{}: {} generated in {:.1f}s ({:.0f} rows/s)'.format(
+            model.__name__, inserted, elapsed, inserted / elapsed if elapsed else 0,
+        ))
@@ -0,0 +1,79 @@
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.caching import catalog_changed
+from core.catalog import CATALOG_FIELDS, UpsertResult, bulk_upsert, open_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Imports the movies and planets catalog from an NDJSON snapshot written by export_catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Snapshot file to read')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows written per transaction',
+        )
+
+    def handle(self, *args, **options):
+        models = {model._meta.label_lower: model for model in CATALOG_FIELDS}
+        batches = {model: [] for model in CATALOG_FIELDS}
+        results = {model: UpsertResult() for model in CATALOG_FIELDS}
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        try:
+            snapshot = open_snapshot(options['path'], 'rt')
+        except OSError as error:
+            raise CommandError('Cannot open snapshot: {}'.format(error))
+
+        with snapshot:
+            for line_number, line in enumerate(snapshot, start=1):
+                if not line.strip():
+                    continue
+                model, fields = self.parse_entry(models, line, line_number)
+                batch = batches[model]
+                batch.append(fields)
+                if len(batch) >= batch_size:
+                    results[model] += bulk_upsert(model, batch, batch_size=batch_size)
+                    batch.clear()
+
+        for model, batch in batches.items():
+            if batch:
+                results[model] += bulk_upsert(model, batch, batch_size=batch_size)
+
+        if any(result.inserted or result.updated for result in results.values()):
+            catalog_changed()
+
+        elapsed = time.monotonic() - started
+        for model, result in results.items():
+            self.stdout.write('{}: {}'.format(model.__name__, result.describe(elapsed)))
+
+    @staticmethod
+    def parse_entry(models, line, line_number):
+        """
+            Returns the catalog model and the fields of a snapshot line, checking that every synced field is present and
+            valid, so a broken snapshot stops the import on the offending entry.
+        """
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise CommandError('Invalid JSON on line {}: {}'.format(line_number, line.strip()))
+        model = models.get(entry.get('model')) if isinstance(entry, dict) else None
+        fields = entry.get('fields') if model is not None else None
+        if not isinstance(fields, dict):
+            raise CommandError('Invalid snapshot entry on line {}: {}'.format(line_number, line.strip()))
+        key_field, synced_fields = CATALOG_FIELDS[model]
+        for field in (key_field,) + synced_fields:
+            if field not in fields:
+                raise CommandError('Missing field {} on line {}: {}'.format(field, line_number, line.strip()))
+            try:
+                model._meta.get_field(field).to_python(fields[field])
+            except ValidationError:
+                raise CommandError('Invalid field {} on line {}: {}'.format(field, line_number, line.strip()))
+        return model, fields
@@ -1,7 +1,11 @@
-import requests
-from django.core.management.base import BaseCommand
+import time
 
-from core.models import Movies, Planets
+from django.core.management.base import BaseCommand, CommandError
+
+from core.caching import catalog_changed
+from core.catalog import UpsertResult, bulk_upsert, content_hash
+from core.fetcher import CatalogFetcher, FetchError
+from core.models import Movies, Planets, SyncCheckpoint
 
 from decouple import config
 
@@ -9,39 +13,130 @@ from decouple import config
 class Command(BaseCommand):
     help = 'Loads movies and planets from the Star Wars API'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Diff every fetched page against the existing rows and write it with batched inserts/updates',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows written per transaction in bulk mode',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Bulk mode with conditional requests and a resumable per-page checkpoint',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint of an interrupted incremental sync and start from the first page',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Maximum number of pages fetched concurrently',
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=3,
+            help='Number of retries for pages failing with a 5xx status or a timeout',
+        )
+
     def handle(self, *args, **options):
-        # Make API request to get movies data
-        url = config('PLANET_DATA_URL')
-        while url:
-            response = requests.get(url)
-            print("Planet data: ", response)
-            if response.status_code == 200:
-                data = response.json()
-                for planet_data in data['results']:
-                    Planets.objects.update_or_create(
-                        name=planet_data['name'],
-                        defaults={
-                            'url': planet_data['url'],
-                        }
-                    )
-                url = data['next']
+        feeds = {
+            Planets: config('PLANET_DATA_URL'),
+            Movies: config('MOVIE_DATA_URL'),
+        }
+        bulk = options['bulk'] or options['incremental']
+        results = {model: UpsertResult() for model in feeds}
+        not_modified = {model: 0 for model in feeds}
+        checkpoints, sync_state = {}, {}
+        if options['incremental']:
+            checkpoints, sync_state = self.load_checkpoints(feeds, options['restart'])
+        completed_pages = {model: set() for model in feeds}
+        started = time.monotonic()
+
+        # pages are written on this thread while the fetcher keeps downloading the following ones
+        with CatalogFetcher(workers=options['workers'], retries=options['retries']) as fetcher:
+            try:
+                for page in fetcher.stream(feeds, **sync_state):
+                    if page.results is None:
+                        not_modified[page.feed] += 1
+                    elif bulk:
+                        results[page.feed] += bulk_upsert(page.feed, page.results, batch_size=options['batch_size'])
+                    else:
+                        self.write_records(page.feed, page.results)
+                    if checkpoints:
+                        self.save_checkpoint(checkpoints[page.feed], page, completed_pages[page.feed])
+            except FetchError as error:
+                raise CommandError(str(error))
+
+        # cached list pages are keyed on the catalog version, bumping it retires all of them at once
+        if not bulk or any(result.inserted or result.updated for result in results.values()):
+            catalog_changed()
+
+        if bulk:
+            elapsed = time.monotonic() - started
+            for model, result in results.items():
+                self.stdout.write('{}: {}'.format(model.__name__, result.describe(elapsed)))
+                if options['incremental']:
+                    self.stdout.write('{}: {} pages not modified'.format(model.__name__, not_modified[model]))
+
+    def load_checkpoints(self, feeds, restart):
+        checkpoints = {}
+        validators, page_counts, resume = {}, {}, {}
+        for model in feeds:
+            checkpoint, _ = SyncCheckpoint.objects.get_or_create(feed=model.__name__.lower())
+            validators.update(checkpoint.validators)
+            if checkpoint.page_count:
+                page_counts[model] = checkpoint.page_count
+            if checkpoint.interrupted and not restart:
+                resume[model] = checkpoint.last_page + 1
+                self.stdout.write('{}: resuming from page {} of {}'.format(
+                    model.__name__, resume[model], checkpoint.page_count,
+                ))
             else:
-                url = None
-
-        url = config('MOVIE_DATA_URL')
-        while url:
-            print("Movies data: ", response)
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                for movie_data in data['results']:
-                    Movies.objects.update_or_create(
-                        title=movie_data['title'],
-                        defaults={
-                            'release_date': movie_data['release_date'],
-                            'url': movie_data['url'],
-                        }
-                    )
-                url = data['next']
+                checkpoint.last_page = 0
+                checkpoint.save(update_fields=['last_page', 'updated_at'])
+            checkpoints[model] = checkpoint
+        return checkpoints, {'validators': validators, 'page_counts': page_counts, 'resume': resume}
+
+    @staticmethod
+    def save_checkpoint(checkpoint, page, completed_pages):
+        """
+            Records a written page: remembers its validators and advances the checkpoint over every page completed
+            without gaps, so an interrupted sync resumes after the last of them.
+        """
+        checkpoint.page_count = page.page_count or max(checkpoint.page_count, page.number)
+        if page.etag or page.last_modified:
+            checkpoint.validators[page.url] = {'etag': page.etag, 'last_modified': page.last_modified}
+        completed_pages.add(page.number)
+        while checkpoint.last_page + 1 in completed_pages:
+            checkpoint.last_page += 1
+        checkpoint.save()
+
+    def write_records(self, model, records):
+        for record in records:
+            if model is Planets:
+                Planets.objects.update_or_create(
+                    name=record['name'],
+                    defaults={
+                        'url': record['url'],
+                        'content_hash': content_hash(Planets, record),
+                    }
+                )
             else:
-                url = None
+                Movies.objects.update_or_create(
+                    title=record['title'],
+                    defaults={
+                        'release_date': record['release_date'],
+                        'url': record['url'],
+                        'content_hash': content_hash(Movies, record),
+                    }
+                )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.favorites import reconcile_favorite_counts
+from core.models import Movies, Planets
+
+
+class Command(BaseCommand):
+    help = 'Recounts the favorites of every planet and movie, and fixes the favorite counts found wrong'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Number of catalog rows recounted per transaction',
+        )
+
+    def handle(self, *args, **options):
+        for model in (Planets, Movies):
+            started = time.monotonic()
+            fixed = reconcile_favorite_counts(model, options['batch_size'])
+            self.stdout.write('{}: {} favorite counts fixed in {:.1f}s'.format(
+                model.__name__, fixed, time.monotonic() - started,
+            ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.warmup import WARM_UP_PAGES, warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Caches the first catalog pages and builds the in-memory indexes. The server warms every worker by itself; '
+        'running this command only helps a cache backend shared between processes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=WARM_UP_PAGES,
+            help='Number of pages cached per catalog',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        cached = warm_up(options['pages'])
+        for model_name, count in cached.items():
+            self.stdout.write('{}: {} pages cached'.format(model_name, count))
+        self.stdout.write('Warmed up in {:.2f}s'.format(time.monotonic() - started))
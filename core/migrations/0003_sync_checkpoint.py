@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_rename_custom_name_favoritemovies_custom_title_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(max_length=64, unique=True)),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('last_page', models.PositiveIntegerField(default=0)),
+                ('validators', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='movies',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='planets',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='movies',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='planets',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='favoritemovies',
+            constraint=models.UniqueConstraint(fields=('user_id', 'movie'), name='favorite_movie_pk'),
+        ),
+        migrations.AddConstraint(
+            model_name='favoriteplanets',
+            constraint=models.UniqueConstraint(fields=('user_id', 'planet'), name='favorite_planet_pk'),
+        ),
+    ]
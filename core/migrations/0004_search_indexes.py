@@ -0,0 +1,64 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# table, indexed column and search index table of every searchable model
+SEARCH_INDEXES = [
+    ('core_planets', 'name', 'core_planets_search'),
+    ('core_movies', 'title', 'core_movies_search'),
+    ('core_favoriteplanets', 'custom_name', 'core_favoriteplanets_search'),
+    ('core_favoritemovies', 'custom_title', 'core_favoritemovies_search'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+        Creates an FTS5 trigram index over every searchable column, kept in sync with its table by triggers. Only
+        SQLite builds with FTS5 trigram support (3.34+) get the indexes; searches fall back to LIKE scans otherwise.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute("CREATE VIRTUAL TABLE temp.trigram_probe USING fts5(probe, tokenize='trigram')")
+        schema_editor.execute('DROP TABLE temp.trigram_probe')
+    except OperationalError:
+        return
+
+    for table, column, index in SEARCH_INDEXES:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {index} USING fts5("
+            f"{column}, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {index}(rowid, {column}) VALUES (new.id, new.{column}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {index}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+            f"INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+            f"INSERT INTO {index}(rowid, {column}) VALUES (new.id, new.{column}); END"
+        )
+        schema_editor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, column, index in SEARCH_INDEXES:
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {index}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
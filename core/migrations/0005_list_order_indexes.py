@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movies',
+            index=models.Index(fields=['created_at', 'id'], name='movies_created_at_id'),
+        ),
+        migrations.AddIndex(
+            model_name='planets',
+            index=models.Index(fields=['created_at', 'id'], name='planets_created_at_id'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# catalog model, favorite model and favorite foreign key of every counted catalog model
+COUNTED_MODELS = [('Planets', 'FavoritePlanets', 'planet'), ('Movies', 'FavoriteMovies', 'movie')]
+
+
+def favorite_count_field():
+    field = models.PositiveIntegerField(default=0)
+    field.set_attributes_from_name('favorite_count')
+    return field
+
+
+def add_favorite_counts(apps, schema_editor):
+    """
+        Adds the favorite_count columns. SQLite would rebuild the catalog tables to add a column with a default, which
+        drops the triggers of their search indexes (see 0004): the columns are added in place there.
+    """
+    for model_name, favorite_model_name, field_name in COUNTED_MODELS:
+        model = apps.get_model('core', model_name)
+        if schema_editor.connection.vendor == 'sqlite':
+            table, column = schema_editor.quote_name(model._meta.db_table), schema_editor.quote_name('favorite_count')
+            schema_editor.execute(
+                f'ALTER TABLE {table} ADD COLUMN {column} integer unsigned NOT NULL DEFAULT 0 CHECK ({column} >= 0)'
+            )
+        else:
+            schema_editor.add_field(model, favorite_count_field())
+
+
+def remove_favorite_counts(apps, schema_editor):
+    for model_name, favorite_model_name, field_name in COUNTED_MODELS:
+        schema_editor.remove_field(apps.get_model('core', model_name), favorite_count_field())
+
+
+def count_existing_favorites(apps, schema_editor):
+    """
+        Counts the favorites created before the counters existed.
+    """
+    for model_name, favorite_model_name, field_name in COUNTED_MODELS:
+        model = apps.get_model('core', model_name)
+        favorites = apps.get_model('core', favorite_model_name).objects.filter(**{field_name: models.OuterRef('pk')})
+        count = favorites.values(field_name).annotate(count=models.Count('id')).values('count')
+        model.objects.update(favorite_count=Coalesce(models.Subquery(count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_list_order_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_favorite_counts, remove_favorite_counts),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='movies',
+                    name='favorite_count',
+                    field=models.PositiveIntegerField(default=0),
+                ),
+                migrations.AddField(
+                    model_name='planets',
+                    name='favorite_count',
+                    field=models.PositiveIntegerField(default=0),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='movies',
+            index=models.Index(fields=['favorite_count', 'id'], name='movies_favorite_count_id'),
+        ),
+        migrations.AddIndex(
+            model_name='planets',
+            index=models.Index(fields=['favorite_count', 'id'], name='planets_favorite_count_id'),
+        ),
+        migrations.RunPython(count_existing_favorites, migrations.RunPython.noop),
+    ]
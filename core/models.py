@@ -16,16 +16,38 @@ class Movies(BaseModel):
     title = models.CharField(max_length=255, db_index=True)
     release_date = models.DateField()
     url = models.URLField()
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    # number of users having this row as a favorite, maintained by core.favorites.count_favorites()
+    favorite_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # list pages are ordered, and cursors compare, on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='movies_created_at_id'),
+            # top favorites are read backwards from the highest count
+            models.Index(fields=['favorite_count', 'id'], name='movies_favorite_count_id'),
+        ]
+
 
 class Planets(BaseModel):
     name = models.CharField(max_length=255, db_index=True)
     url = models.URLField()
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    # number of users having this row as a favorite, maintained by core.favorites.count_favorites()
+    favorite_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # list pages are ordered, and cursors compare, on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='planets_created_at_id'),
+            # top favorites are read backwards from the highest count
+            models.Index(fields=['favorite_count', 'id'], name='planets_favorite_count_id'),
+        ]
+
 
 class FavoriteMovies(BaseModel):
     user_id = models.BigIntegerField()
@@ -51,3 +73,19 @@ class FavoritePlanets(BaseModel):
         constraints = [
             models.UniqueConstraint(fields=['user_id', 'planet'], name='favorite_planet_pk'),
         ]
+
+
+class SyncCheckpoint(BaseModel):
+    """
+        Progress of the incremental catalog sync of one feed: the last page written without gaps, the page count
+        reported by the source and the ETag / Last-Modified validators of every page seen so far.
+    """
+    feed = models.CharField(max_length=64, unique=True)
+    page_count = models.PositiveIntegerField(default=0)
+    last_page = models.PositiveIntegerField(default=0)
+    validators = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def interrupted(self):
+        return 0 < self.last_page < self.page_count
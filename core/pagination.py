@@ -0,0 +1,142 @@
+import base64
+import math
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.core.paginator import Paginator
+from django.db import models
+from django.urls import reverse
+
+PAGE_SIZE = 10
+
+# query parameters carried over to the next_page link, in link order
+LINK_PARAMS = ('search_by', 'user_id', 'count')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    """
+        Returns the opaque cursor pointing right after the row with the given created_at and id.
+    """
+    raw = '{}|{}'.format(created_at.isoformat(), pk).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def paginate_by_cursor(queryset, cursor=None, page_size=PAGE_SIZE):
+    """
+        Returns one page of the queryset ordered by newest first, and the cursor of the following page (None on the
+        last page).
+
+        Rows are selected with a `(created_at, id) < cursor` range condition instead of an OFFSET, so the cost of a
+        page does not depend on its depth, and no COUNT query is run.
+    """
+    rows = list(_after_cursor(queryset, cursor)[:page_size + 1])
+    return _cursor_page(rows, page_size)
+
+
+async def apaginate_by_cursor(queryset, cursor=None, page_size=PAGE_SIZE):
+    rows = [row async for row in _after_cursor(queryset, cursor)[:page_size + 1]]
+    return _cursor_page(rows, page_size)
+
+
+def _after_cursor(queryset, cursor):
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # the redundant created_at bound lets the (created_at, id) index seek to the cursor instead of walking to it
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            models.Q(created_at__lt=created_at) | models.Q(id__lt=pk)
+        )
+    return queryset
+
+
+def _cursor_page(rows, page_size):
+    if len(rows) <= page_size:
+        return rows, None
+    last = rows[page_size - 1]
+    return rows[:page_size], encode_cursor(last.created_at, last.pk)
+
+
+def page_cache_key(request):
+    """
+        Returns the part of a list response cache key identifying the requested page.
+    """
+    if request.GET.get('page') is not None:
+        key = 'page={}'.format(request.GET['page'])
+    else:
+        key = 'cursor={}'.format(request.GET.get('cursor', ''))
+    return key + (':count' if wants_count(request) else '')
+
+
+def wants_count(request):
+    return request.GET.get('count', '').lower() in ('1', 'true')
+
+
+def paginate(request, queryset):
+    """
+        Paginates the queryset of a list view.
+
+        With a `page` query parameter the legacy page-number pagination is used. Otherwise the page is selected by the
+        opaque `cursor` query parameter, and the total number of rows is only counted when `count=true` is passed.
+
+        Returns the rows of the page, the query parameters selecting the next page (None on the last page) and the
+        total number of rows (None unless counted). Raises InvalidCursor for a malformed cursor.
+    """
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        page_obj = Paginator(queryset.order_by('-created_at', '-id'), PAGE_SIZE).get_page(page_number)
+        next_params = {'page': page_obj.next_page_number()} if page_obj.has_next() else None
+        return list(page_obj), next_params, None
+
+    rows, next_cursor = paginate_by_cursor(queryset, request.GET.get('cursor'))
+    next_params = {'cursor': next_cursor} if next_cursor else None
+    count = queryset.count() if wants_count(request) else None
+    return rows, next_params, count
+
+
+async def apaginate(request, queryset):
+    """
+        Async version of paginate(), running its queries through the async ORM.
+    """
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        count = await queryset.acount()
+        num_pages = max(1, math.ceil(count / PAGE_SIZE))
+        try:
+            number = int(page_number)
+        except ValueError:
+            number = 1
+        # same fallbacks as Paginator.get_page: out of range page numbers give the last page
+        if number < 1 or number > num_pages:
+            number = num_pages
+        ordered = queryset.order_by('-created_at', '-id')
+        rows = [row async for row in ordered[(number - 1) * PAGE_SIZE:number * PAGE_SIZE]]
+        return rows, ({'page': number + 1} if number < num_pages else None), None
+
+    rows, next_cursor = await apaginate_by_cursor(queryset, request.GET.get('cursor'))
+    next_params = {'cursor': next_cursor} if next_cursor else None
+    count = await queryset.acount() if wants_count(request) else None
+    return rows, next_params, count
+
+
+def page_link(request, view_name, next_params):
+    """
+        Returns the next_page link of a list view, carrying the search and user parameters of the request.
+    """
+    if not next_params:
+        return None
+    params = dict(next_params)
+    params.update((param, request.GET[param]) for param in LINK_PARAMS if request.GET.get(param))
+    return reverse(view_name) + '?' + urlencode(params)
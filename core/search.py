@@ -0,0 +1,43 @@
+from django.db import connection, models
+from django.db.models.expressions import RawSQL
+
+from core.models import FavoriteMovies, FavoritePlanets, Movies, Planets
+
+# trigram search index and indexed column of every searchable model, see migration 0004
+SEARCH_INDEXES = {
+    Planets: ('core_planets_search', 'name'),
+    Movies: ('core_movies_search', 'title'),
+    FavoritePlanets: ('core_favoriteplanets_search', 'custom_name'),
+    FavoriteMovies: ('core_favoritemovies_search', 'custom_title'),
+}
+
+# trigram indexes can only serve queries spanning at least one trigram
+MIN_INDEXED_LENGTH = 3
+
+_available = None
+
+
+def search_indexes_available():
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and 'core_planets_search' in connection.introspection.table_names()
+    return _available
+
+
+def contains(model, query):
+    """
+        Returns a filter selecting the rows of the model whose searchable column contains the query, with the
+        semantics of `icontains`.
+
+        When the trigram indexes exist, the candidate rows are found with an index MATCH and then checked with the
+        same LIKE comparison `icontains` uses, instead of running that LIKE over the whole table.
+    """
+    table, column = SEARCH_INDEXES[model]
+    if len(query) < MIN_INDEXED_LENGTH or not search_indexes_available():
+        return models.Q(**{column + '__icontains': query})
+    match = '{}: "{}"'.format(column, query.replace('"', '""'))
+    pattern = '%{}%'.format(query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+    return models.Q(pk__in=RawSQL(
+        f"SELECT rowid FROM {table} WHERE {table} MATCH %s AND {column} LIKE %s ESCAPE '\\'",
+        (match, pattern),
+    ))
@@ -0,0 +1,36 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.caching import catalog_changed
+from core.favorites import FAVORITE_FIELDS, count_favorites
+from core.models import FavoriteMovies, FavoritePlanets, Movies, Planets
+
+# catalog model and catalog foreign key of every favorite model
+FAVORITE_CATALOGS = {
+    favorite_model: (model, id_field) for model, (favorite_model, id_field, name_field) in FAVORITE_FIELDS.items()
+}
+
+
+@receiver(post_save, sender=Movies)
+@receiver(post_save, sender=Planets)
+@receiver(post_delete, sender=Movies)
+@receiver(post_delete, sender=Planets)
+def on_catalog_change(sender, **kwargs):
+    # bulk writes do not send signals, their callers bump the catalog version themselves
+    catalog_changed()
+
+
+@receiver(post_save, sender=FavoriteMovies)
+@receiver(post_save, sender=FavoritePlanets)
+def on_favorite_save(sender, instance, created, **kwargs):
+    # runs in the transaction of get_or_create(); bulk inserts send no signals, see core.favorites.insert_favorites
+    if created:
+        model, id_field = FAVORITE_CATALOGS[sender]
+        count_favorites(model, [getattr(instance, id_field)])
+
+
+@receiver(post_delete, sender=FavoriteMovies)
+@receiver(post_delete, sender=FavoritePlanets)
+def on_favorite_delete(sender, instance, **kwargs):
+    model, id_field = FAVORITE_CATALOGS[sender]
+    count_favorites(model, [getattr(instance, id_field)], step=-1)
@@ -1,10 +1,55 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from collections import Counter
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from django.test import TestCase
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework.utils import json
 
-from .models import Movies, FavoriteMovies, Planets, FavoritePlanets
+from starwars.db import READ_ALIAS
+from starwars.metrics import metrics
+from starwars.sqlite.base import DatabaseWrapper
+from starwars.logger import (
+    LOG_FORMAT, CustomJsonFormatter, Logger, LogSampler, MessageRateLimiter, parse_sample_rates,
+)
+
+from . import async_views
+from .bitsets import SparseBitset
+from .caching import (
+    CACHE_TIMEOUT, CATALOG_VERSION_KEY, TieredCache, bump_version, catalog_changed, get_versions, list_cache,
+    favorites_version_key, list_versions,
+)
+from .catalog import bulk_upsert, name_indexes
+from .encoding import dumps, format_datetime, get_dumps
+from .favorites import (
+    FAVORITE_BATCH_LIMIT, TOP_FAVORITES_LIMIT, FavoriteBuffer, FavoriteSet, favorites_added, get_favorites,
+)
+from .fetcher import CatalogFetcher, FetchError
+from .models import Movies, FavoriteMovies, Planets, FavoritePlanets, SyncCheckpoint
+from .search import contains, search_indexes_available
+from .warmup import warm_up
 
 
 class FavoriteMoviesTestCase(TestCase):
@@ -40,6 +85,11 @@ class FavoriteMoviesTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['error'], 'Missing required data')
 
+    def test_add_favorite_movie_invalid_title(self):
+        response = self.client.post(self.url, {'title': 123, 'user_id': self.user_id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Invalid title')
+
     def test_add_favorite_movie_movie_not_found(self):
         data = {'title': 'Not Found', 'user_id': self.user_id, 'custom_title': self.custom_title}
         response = self.client.post(self.url, data, format='json')
@@ -152,3 +202,1278 @@ class GetMovieListTestCase(TestCase):
         self.assertEqual(content['results'][0]['title'], 'My Inception')
         self.assertEqual(content['results'][0]['release_date'], '2010-07-16')
         self.assertEqual(content['results'][0]['is_favourite'], True)
+
+
+class BulkUpsertTestCase(TestCase):
+    def setUp(self):
+        self.planet = Planets.objects.create(name='Tatooine', url='https://swapi.dev/api/planets/1/')
+
+    def test_bulk_upsert_counts(self):
+        records = [
+            {'name': 'Tatooine', 'url': 'https://swapi.dev/api/planets/1/'},
+            {'name': 'Alderaan', 'url': 'https://swapi.dev/api/planets/2/'},
+            {'name': 'Hoth', 'url': 'https://swapi.dev/api/planets/4/'},
+        ]
+        result = bulk_upsert(Planets, records, batch_size=2)
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (2, 0, 1))
+        self.assertEqual(Planets.objects.count(), 3)
+
+    def test_bulk_upsert_only_touches_changed_rows(self):
+        updated_at = self.planet.updated_at
+        result = bulk_upsert(Planets, [{'name': 'Tatooine', 'url': 'https://swapi.dev/api/planets/1/'}])
+        self.assertEqual(result.unchanged, 1)
+        self.planet.refresh_from_db()
+        self.assertEqual(self.planet.updated_at, updated_at)
+
+        result = bulk_upsert(Planets, [{'name': 'Tatooine', 'url': 'https://swapi.dev/api/planets/99/'}])
+        self.assertEqual(result.updated, 1)
+        self.planet.refresh_from_db()
+        self.assertEqual(self.planet.url, 'https://swapi.dev/api/planets/99/')
+        self.assertGreater(self.planet.updated_at, updated_at)
+
+    def test_bulk_upsert_parses_movie_dates(self):
+        Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+        result = bulk_upsert(Movies, [
+            {'title': 'A New Hope', 'release_date': '1977-05-25', 'url': 'https://swapi.dev/api/films/1/'},
+        ])
+        self.assertEqual(result.unchanged, 1)
+
+
+class StubSwapiHandler(BaseHTTPRequestHandler):
+    """
+        Serves `/planets` and `/films` as paginated JSON, two records per page, failing once with a 503 when the
+        requested page is listed in `flaky_pages`. Pages carry an ETag and honour If-None-Match; every request is
+        recorded in `requested` as a `(path, page, status)` tuple.
+    """
+    feeds = {}
+    flaky_pages = set()
+    requested = []
+    per_page = 2
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        records = self.feeds.get(parts.path)
+        page = int(parse_qs(parts.query).get('page', ['1'])[0])
+        if records is None:
+            return self.send_error(404)
+        if (parts.path, page) in self.flaky_pages:
+            self.flaky_pages.discard((parts.path, page))
+            self.requested.append((parts.path, page, 503))
+            return self.send_error(503)
+        start = (page - 1) * self.per_page
+        has_next = start + self.per_page < len(records)
+        body = json.dumps({
+            'count': len(records),
+            'next': 'http://{}:{}{}?page={}'.format(*self.server.server_address, parts.path, page + 1)
+            if has_next else None,
+            'results': records[start:start + self.per_page],
+        }).encode()
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.requested.append((parts.path, page, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.requested.append((parts.path, page, 200))
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubSwapiTestMixin:
+    planets = [{'name': 'Planet {}'.format(i), 'url': 'https://swapi.dev/api/planets/{}/'.format(i)} for i in range(7)]
+    films = [
+        {'title': 'Film {}'.format(i), 'release_date': '1977-05-25', 'url': 'https://swapi.dev/api/films/{}/'.format(i)}
+        for i in range(3)
+    ]
+
+    def setUp(self):
+        super().setUp()
+        StubSwapiHandler.feeds = {'/planets': self.planets, '/films': self.films}
+        StubSwapiHandler.flaky_pages = set()
+        StubSwapiHandler.requested = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubSwapiHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://{}:{}'.format(*self.server.server_address)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def swapi_env(self):
+        return mock.patch.dict(os.environ, {
+            'PLANET_DATA_URL': self.base_url + '/planets',
+            'MOVIE_DATA_URL': self.base_url + '/films',
+        })
+
+
+class CatalogFetcherTestCase(StubSwapiTestMixin, TestCase):
+    def test_stream_fetches_every_page_of_every_feed(self):
+        with CatalogFetcher(workers=3, backoff=0) as fetcher:
+            pages = list(fetcher.stream({'planets': self.base_url + '/planets', 'films': self.base_url + '/films'}))
+        planets = [record['name'] for page in pages if page.feed == 'planets' for record in page.results]
+        self.assertCountEqual(planets, [planet['name'] for planet in self.planets])
+        self.assertEqual(sum(len(page.results) for page in pages if page.feed == 'films'), 3)
+        self.assertEqual({page.page_count for page in pages if page.feed == 'planets'}, {4})
+
+    def test_stream_retries_server_errors(self):
+        StubSwapiHandler.flaky_pages = {('/planets', 1), ('/planets', 3)}
+        with CatalogFetcher(workers=2, backoff=0) as fetcher:
+            pages = list(fetcher.stream({'planets': self.base_url + '/planets'}))
+        self.assertEqual(sum(len(page.results) for page in pages), len(self.planets))
+
+    def test_stream_raises_on_client_errors(self):
+        with CatalogFetcher(workers=2, backoff=0) as fetcher:
+            with self.assertRaises(FetchError):
+                list(fetcher.stream({'missing': self.base_url + '/missing'}))
+
+    def test_load_data_bulk(self):
+        out = StringIO()
+        with self.swapi_env():
+            call_command('load_data', '--bulk', '--batch-size', '2', stdout=out)
+        self.assertEqual(Planets.objects.count(), 7)
+        self.assertEqual(Movies.objects.count(), 3)
+        self.assertIn('Planets: 7 inserted, 0 updated, 0 unchanged', out.getvalue())
+
+        out = StringIO()
+        with self.swapi_env():
+            call_command('load_data', '--bulk', stdout=out)
+        self.assertIn('Movies: 0 inserted, 0 updated, 3 unchanged', out.getvalue())
+
+
+class IncrementalSyncTestCase(StubSwapiTestMixin, TestCase):
+    def sync(self, *args):
+        out = StringIO()
+        with self.swapi_env():
+            call_command('load_data', '--incremental', *args, stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_source_is_not_rewritten(self):
+        self.sync()
+        updated_at = Planets.objects.get(name='Planet 0').updated_at
+        checkpoint = SyncCheckpoint.objects.get(feed='planets')
+        self.assertEqual((checkpoint.last_page, checkpoint.page_count), (4, 4))
+
+        StubSwapiHandler.requested = []
+        output = self.sync()
+        self.assertIn('Planets: 4 pages not modified', output)
+        self.assertEqual({status for path, page, status in StubSwapiHandler.requested}, {304})
+        self.assertEqual(Planets.objects.get(name='Planet 0').updated_at, updated_at)
+
+    def test_changed_rows_are_updated(self):
+        self.sync()
+        self.planets[0] = {'name': 'Planet 0', 'url': 'https://swapi.dev/api/planets/100/'}
+        self.addCleanup(self.planets.__setitem__, 0, {'name': 'Planet 0', 'url': 'https://swapi.dev/api/planets/0/'})
+        output = self.sync()
+        self.assertIn('Planets: 0 inserted, 1 updated, 1 unchanged', output)
+        self.assertIn('Planets: 3 pages not modified', output)
+
+    def test_interrupted_sync_resumes_after_checkpoint(self):
+        SyncCheckpoint.objects.create(feed='planets', page_count=4, last_page=2)
+        output = self.sync()
+        self.assertIn('Planets: resuming from page 3 of 4', output)
+        planet_pages = {page for path, page, status in StubSwapiHandler.requested if path == '/planets'}
+        self.assertEqual(planet_pages, {3, 4})
+        self.assertEqual(Planets.objects.count(), 3)
+        self.assertEqual(SyncCheckpoint.objects.get(feed='planets').last_page, 4)
+
+
+class CatalogSnapshotTestCase(TestCase):
+    def setUp(self):
+        Planets.objects.create(name='Tatooine', url='https://swapi.dev/api/planets/1/')
+        Planets.objects.create(name='Hoth', url='https://swapi.dev/api/planets/4/')
+        Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.ndjson.gz')
+
+    def test_export_writes_one_line_per_record(self):
+        call_command('export_catalog', self.path, stdout=StringIO())
+        with gzip.open(self.path, 'rt') as snapshot:
+            entries = [json.loads(line) for line in snapshot]
+        self.assertEqual([entry['model'] for entry in entries], ['core.planets', 'core.planets', 'core.movies'])
+        self.assertEqual(entries[2]['fields']['release_date'], '1977-05-25')
+
+    def test_import_round_trip(self):
+        call_command('export_catalog', self.path, stdout=StringIO())
+        Planets.objects.all().delete()
+        Movies.objects.all().delete()
+
+        out = StringIO()
+        call_command('import_catalog', self.path, '--batch-size', '1', stdout=out)
+        self.assertIn('Planets: 2 inserted, 0 updated, 0 unchanged', out.getvalue())
+        self.assertEqual(set(Planets.objects.values_list('name', flat=True)), {'Tatooine', 'Hoth'})
+        self.assertEqual(str(Movies.objects.get().release_date), '1977-05-25')
+
+        out = StringIO()
+        call_command('import_catalog', self.path, stdout=out)
+        self.assertIn('Movies: 0 inserted, 0 updated, 1 unchanged', out.getvalue())
+
+    def test_import_rejects_invalid_entries(self):
+        for line, message in (
+            ('{"model": "core.planets", "fields": {"name": "Hoth"}}', 'Missing field url on line 2'),
+            ('{"model": "core.movies", "fields": {"title": "A", "release_date": "soon", "url": ""}}',
+             'Invalid field release_date on line 2'),
+            ('{"model": "core.planets"}', 'Invalid snapshot entry on line 2'),
+            ('["core.planets"]', 'Invalid snapshot entry on line 2'),
+        ):
+            with gzip.open(self.path, 'wt') as snapshot:
+                snapshot.write('{"model": "core.planets", "fields": {"name": "Naboo", "url": ""}}\n' + line + '\n')
+            with self.assertRaisesMessage(CommandError, message):
+                call_command('import_catalog', self.path, stdout=StringIO())
+
+
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        Planets.objects.bulk_create([
+            Planets(name='Planet {:02d}'.format(i), url='https://swapi.dev/api/planets/{}/'.format(i)) for i in range(25)
+        ])
+        self.url = reverse('planet-list')
+
+    def test_cursor_walks_every_planet_once(self):
+        names, next_page = [], self.url
+        while next_page:
+            content = json.loads(self.client.get(next_page).content)
+            names += [planet['name'] for planet in content['results']]
+            next_page = content['next_page']
+        self.assertEqual(len(names), 25)
+        self.assertEqual(len(set(names)), 25)
+
+    def test_cursor_pages_do_not_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            content = json.loads(self.client.get(self.url).content)
+        self.assertIn('cursor=', content['next_page'])
+        self.assertNotIn('count', content)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        content = json.loads(self.client.get(self.url, {'count': 'true'}).content)
+        self.assertEqual(content['count'], 25)
+        self.assertIn('count=true', content['next_page'])
+
+    def test_page_number_is_still_supported(self):
+        content = json.loads(self.client.get(self.url, {'page': 3}).content)
+        self.assertEqual(len(content['results']), 5)
+        self.assertIsNone(content['next_page'])
+        content = json.loads(self.client.get(self.url, {'page': 1}).content)
+        self.assertEqual(content['next_page'], self.url + '?page=2')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(connection.vendor == 'sqlite', 'The plans are read with the SQLite EXPLAIN QUERY PLAN')
+    def test_cursor_pages_seek_the_list_order_index(self):
+        next_page = self.url
+        for _ in range(2):
+            next_page = json.loads(self.client.get(next_page).content)['next_page']
+        list_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_page)
+        sql = next(query['sql'] for query in queries.captured_queries if 'FROM "core_planets"' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(any(detail.startswith('SEARCH') and 'planets_created_at_id' in detail for detail in plan), plan)
+        self.assertFalse(any(detail.startswith('SCAN core_planets') for detail in plan), plan)
+
+
+class SharedCatalogPageTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.earth = Planets.objects.create(name='Earth', url='http://localhost:8000/planets/1')
+        self.mars = Planets.objects.create(name='Mars', url='http://localhost:8000/planets/2')
+        FavoritePlanets.objects.create(user_id=1, planet=self.earth, custom_name='Home')
+        self.url = reverse('planet-list')
+
+    def test_users_share_the_catalog_page(self):
+        content = json.loads(self.client.get(self.url, {'user_id': 1}).content)
+        self.assertEqual(
+            [(planet['name'], planet['is_favourite']) for planet in content['results']],
+            [('Mars', False), ('Home', True)],
+        )
+
+        # only the favorites of the second user are loaded, the catalog page comes from the shared cache entry
+        with self.assertNumQueries(1):
+            content = json.loads(self.client.get(self.url, {'user_id': 2}).content)
+        self.assertEqual([planet['name'] for planet in content['results']], ['Mars', 'Earth'])
+        self.assertFalse(any(planet['is_favourite'] for planet in content['results']))
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_search_by_custom_name(self):
+        content = json.loads(self.client.get(self.url, {'user_id': 1, 'search_by': 'hom'}).content)
+        self.assertEqual([planet['name'] for planet in content['results']], ['Home'])
+        content = json.loads(self.client.get(self.url, {'user_id': 2, 'search_by': 'hom'}).content)
+        self.assertEqual(content['results'], [])
+
+    def test_custom_names_of_other_users(self):
+        FavoritePlanets.objects.create(user_id=2, planet=self.earth, custom_name='Terra')
+        FavoritePlanets.objects.create(user_id=3, planet=self.earth, custom_name='Homeworld')
+        FavoritePlanets.objects.create(user_id=3, planet=self.mars)
+        content = json.loads(self.client.get(self.url, {'user_id': 1, 'search_by': 'hom', 'count': 'true'}).content)
+        self.assertEqual((content['count'], [planet['name'] for planet in content['results']]), (1, ['Home']))
+        content = json.loads(self.client.get(self.url, {'user_id': 3, 'search_by': 'r', 'count': 'true'}).content)
+        self.assertEqual(
+            [(planet['name'], planet['is_favourite']) for planet in content['results']],
+            [('Mars', True), ('Homeworld', True)],
+        )
+        self.assertEqual(content['count'], 2)
+
+
+class ListCacheInvalidationTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.movie = Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+        self.url = reverse('movie-list')
+
+    def get_titles(self, **params):
+        content = json.loads(self.client.get(self.url, params).content)
+        return [(movie['title'], movie['is_favourite']) for movie in content['results']]
+
+    def test_add_favorite_invalidates_user_lists(self):
+        self.assertEqual(self.get_titles(user_id=1), [('A New Hope', False)])
+        self.client.post(reverse('add_favorite_movie'), {'title': 'a new hope', 'user_id': 1, 'custom_title': 'Hope'})
+        self.assertEqual(self.get_titles(user_id=1), [('Hope', True)])
+        self.assertEqual(self.get_titles(user_id=1, search_by='hope'), [('Hope', True)])
+
+    def test_catalog_change_invalidates_shared_pages(self):
+        self.assertEqual(self.get_titles(), [('A New Hope', False)])
+        # bulk writes send no signals, so the shared page stays cached until the catalog version is bumped
+        Movies.objects.bulk_create([
+            Movies(title='The Empire Strikes Back', release_date='1980-05-17', url='https://swapi.dev/api/films/2/'),
+        ])
+        self.assertEqual(len(self.get_titles()), 1)
+        catalog_changed()
+        self.assertEqual(len(self.get_titles()), 2)
+        Movies.objects.create(title='Return of the Jedi', release_date='1983-05-25', url='https://swapi.dev/api/films/3/')
+        self.assertEqual(len(self.get_titles()), 3)
+
+    def test_bump_version_survives_eviction(self):
+        version = get_versions(CATALOG_VERSION_KEY)[0]
+        cache.delete(CATALOG_VERSION_KEY)
+        self.assertGreater(bump_version(CATALOG_VERSION_KEY), version)
+
+
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = TieredCache(max_entries=2)
+        self.cache.clear()
+
+    def test_local_and_shared_hits(self):
+        self.assertEqual(self.cache.get_or_set('a', lambda: 1), 1)
+        self.assertEqual(self.cache.get_or_set('a', lambda: 2), 1)
+        TieredCache().get_or_set('a', lambda: 3)
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['hits']), (1, 1, 1))
+
+    def test_local_tier_is_bounded(self):
+        for key in 'abc':
+            self.cache.get_or_set(key, lambda: key)
+        self.assertEqual(self.cache.stats()['local_entries'], 2)
+
+    def test_concurrent_misses_compute_once(self):
+        calls, started = [], threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'value'
+
+        leader = threading.Thread(target=self.cache.get_or_set, args=('slow', compute))
+        leader.start()
+        started.wait()
+        waiters = [threading.Thread(target=self.cache.get_or_set, args=('slow', compute)) for _ in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        for thread in [leader] + waiters:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats()['coalesced'], 3)
+
+    def test_early_refresh_before_expiry(self):
+        # computing took 50ms, so a read half a second before expiry may refresh it early
+        self.cache.get_or_set('a', lambda: time.sleep(0.05) or 1, timeout=60)
+        with mock.patch('core.caching.time.time', return_value=time.time() + 59.5), \
+                mock.patch('core.caching.random.random', return_value=1e-9):
+            self.assertEqual(self.cache.get_or_set('a', lambda: 2, timeout=60), 2)
+        self.assertEqual(self.cache.stats()['early_refreshes'], 1)
+
+    def test_cache_stats_endpoint(self):
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('coalesced', json.loads(response.content))
+
+
+class SearchIndexTestCase(TestCase):
+    names = ['Tatooine', 'Alderaan', 'Yavin IV', 'Dagobah', '50%_off "deal"', 'Stewjon']
+
+    def setUp(self):
+        list_cache.clear()
+        self.planets = [Planets.objects.create(name=name, url='https://swapi.dev/api/planets/') for name in self.names]
+
+    def assertSameAsIcontains(self, query):
+        indexed = set(Planets.objects.filter(contains(Planets, query)).values_list('name', flat=True))
+        scanned = set(Planets.objects.filter(name__icontains=query).values_list('name', flat=True))
+        self.assertEqual(indexed, scanned, query)
+
+    def test_matches_icontains(self):
+        self.assertTrue(search_indexes_available())
+        for query in ['too', 'TOO', 'aan', 'a', 'ob', 'iv', '%_o', '"deal"', 'nothing', 'tatooine']:
+            self.assertSameAsIcontains(query)
+
+    def test_search_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Planets.objects.filter(contains(Planets, 'dago')))
+        self.assertIn('MATCH', queries.captured_queries[0]['sql'])
+
+    def test_index_follows_writes(self):
+        self.planets[0].name = 'Jakku'
+        self.planets[0].save()
+        self.planets[1].delete()
+        Planets.objects.bulk_create([Planets(name='Jedha', url='https://swapi.dev/api/planets/')])
+        for query in ['too', 'jak', 'alde', 'jedha']:
+            self.assertSameAsIcontains(query)
+
+    def test_favorite_custom_names_are_indexed(self):
+        FavoritePlanets.objects.create(user_id=1, planet=self.planets[0], custom_name='Home sweet home')
+        FavoritePlanets.objects.create(user_id=2, planet=self.planets[1], custom_name='Homeworld')
+        matches = FavoritePlanets.objects.filter(contains(FavoritePlanets, 'home'), user_id=1)
+        self.assertEqual(list(matches.values_list('planet_id', flat=True)), [self.planets[0].id])
+
+        content = json.loads(self.client.get(reverse('planet-list'), {'user_id': 1, 'search_by': 'sweet'}).content)
+        self.assertEqual([planet['name'] for planet in content['results']], ['Home sweet home'])
+
+
+class CatalogNameIndexTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.planet = Planets.objects.create(name='Tatooine', url='https://swapi.dev/api/planets/1/')
+        self.index = name_indexes[Planets]
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertEqual(self.index.lookup('TATOOINE'), self.planet.id)
+        self.assertIsNone(self.index.lookup('Hoth'))
+
+    def test_unknown_names_do_not_query(self):
+        self.index.lookup('Tatooine')
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.index.lookup('Hoth'))
+            response = self.client.post(reverse('add_favorite_planet'), {'name': 'Hoth', 'user_id': 1})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_follows_catalog_version(self):
+        self.index.lookup('Tatooine')
+        hoth = Planets.objects.create(name='Hoth', url='https://swapi.dev/api/planets/4/')
+        self.assertEqual(self.index.lookup('hoth'), hoth.id)
+
+    def test_index_expires(self):
+        # rows written by another process on a process-local cache backend leave the local catalog version unchanged
+        self.index.lookup('Tatooine')
+        hoth = Planets.objects.bulk_create([Planets(name='Hoth', url='https://swapi.dev/api/planets/4/')])[0]
+        self.assertIsNone(self.index.lookup('hoth'))
+        self.index._built_at -= CACHE_TIMEOUT
+        self.assertEqual(self.index.lookup('hoth'), hoth.id)
+
+
+class FavoriteBatchTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        self.movies = [
+            Movies.objects.create(title=title, release_date='1977-05-25', url='https://swapi.dev/api/films/')
+            for title in ('A New Hope', 'The Empire Strikes Back', 'Return of the Jedi')
+        ]
+        FavoriteMovies.objects.create(user_id=1, movie=self.movies[1])
+        self.url = reverse('add_favorite_movies_batch')
+
+    def test_batch_results(self):
+        items = [
+            {'title': 'a new hope', 'custom_title': 'Hope'},
+            {'title': 'The Empire Strikes Back'},
+            {'title': 'The Phantom Menace'},
+            {'custom_title': 'untitled'},
+            {'title': 'Return of the Jedi'},
+            {'title': 'RETURN OF THE JEDI'},
+        ]
+        # with a warm title index: one query for the existing favorites, one bulk insert and one count update, in a
+        # transaction (a savepoint in tests)
+        name_indexes[Movies].lookup('A New Hope')
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, {'user_id': 1, 'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'exists', 'not_found', 'invalid', 'created', 'exists'],
+        )
+        self.assertEqual(FavoriteMovies.objects.get(user_id=1, movie=self.movies[0]).custom_title, 'Hope')
+        self.assertEqual(FavoriteMovies.objects.filter(user_id=1).count(), 3)
+        self.assertEqual(
+            list(Movies.objects.order_by('id').values_list('favorite_count', flat=True)),
+            [1, 1, 1],
+        )
+
+    def test_batch_limits(self):
+        response = self.client.post(self.url, {'user_id': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        items = [{'title': 'A New Hope'}] * (FAVORITE_BATCH_LIMIT + 1)
+        response = self.client.post(self.url, {'user_id': 1, 'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_planet_batch(self):
+        Planets.objects.create(name='Hoth', url='https://swapi.dev/api/planets/4/')
+        response = self.client.post(
+            reverse('add_favorite_planets_batch'),
+            {'user_id': 2, 'items': [{'name': 'hoth', 'custom_name': 'Cold'}]},
+            format='json',
+        )
+        self.assertEqual(response.data['results'], [{'name': 'hoth', 'status': 'created'}])
+        self.assertEqual(FavoritePlanets.objects.get(user_id=2).custom_name, 'Cold')
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.earth = Planets.objects.create(name='Earth', url='http://localhost:8000/planets/1')
+        Planets.objects.create(name='Mars', url='http://localhost:8000/planets/2')
+        FavoritePlanets.objects.create(user_id=1, planet=self.earth, custom_name='Home')
+        self.url = reverse('planet-list')
+
+    async def test_list_matches_sync_view(self):
+        for params in ({}, {'user_id': 1}, {'user_id': 1, 'search_by': 'hom'}, {'count': 'true', 'search_by': 'ar'}):
+            expected = await self.async_client.get(self.url, params)
+            list_cache.clear()
+            response = await async_views.get_planet_list(self.factory.get(self.url, params))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, expected.content)
+
+    def test_local_hit_runs_no_query(self):
+        get_planet_list = async_to_sync(async_views.get_planet_list)
+        get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+        with self.assertNumQueries(0):
+            response = get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+        self.assertEqual(json.loads(response.content)['results'][1]['name'], 'Home')
+
+    def test_local_hit_skips_the_shared_cache(self):
+        get_planet_list = async_to_sync(async_views.get_planet_list)
+        get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+        # the shared cache is only reached through a thread
+        with mock.patch('core.caching.cache') as shared:
+            with self.assertNumQueries(0):
+                response = get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+        self.assertEqual(json.loads(response.content)['results'][1]['name'], 'Home')
+        self.assertEqual(shared.mock_calls, [])
+        # another process moves the favorites version: it is seen once the local copy of the versions expires
+        cache.incr(favorites_version_key(Planets, 1))
+        with self.assertNumQueries(0):
+            get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+        with mock.patch('core.caching.LOCAL_VERSION_TTL', 0), self.assertNumQueries(1):
+            get_planet_list(self.factory.get(self.url, {'user_id': 1}))
+
+    async def test_add_favorite(self):
+        url = reverse('add_favorite_planet')
+        request = self.factory.post(url, {'name': 'mars', 'user_id': 1}, content_type='application/json')
+        response = await async_views.add_favorite_planet(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = await async_views.add_favorite_planet(self.factory.post(url, {'name': 'Mars', 'user_id': 1}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await async_views.add_favorite_planet(self.factory.post(url, {'name': 'Hoth', 'user_id': 1}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        request = self.factory.post(url, {'name': ['mars'], 'user_id': 1}, content_type='application/json')
+        response = await async_views.add_favorite_planet(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await async_views.add_favorite_planet(self.factory.get(url))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(await FavoritePlanets.objects.filter(user_id=1).acount(), 2)
+
+
+class LoggerTestCase(TestCase):
+    def setUp(self):
+        self.logger = Logger()
+
+    def test_disabled_level_builds_nothing(self):
+        with mock.patch.object(Logger, 'generate_data_for_logger') as generate_data:
+            with self.assertLogs(self.logger._logger, 'ERROR'):
+                self.logger.info('not logged')
+                self.logger.error('logged')
+        self.assertEqual(generate_data.call_count, 1)
+
+    def test_record_is_encoded_once(self):
+        with self.assertLogs(self.logger._logger, 'INFO') as logs:
+            self.logger.info({'message': 'added', 'ids': {1}})
+        record = logs.records[0]
+        self.assertEqual(record.funcName, 'test_record_is_encoded_once')
+        line = json.loads(CustomJsonFormatter(LOG_FORMAT, json_default=Logger.serialize_sets).format(record))
+        self.assertEqual(line['message'], 'added')
+        self.assertEqual(line['ids'], [1])
+        self.assertEqual(line['level'], 'INFO')
+        self.assertEqual(line['function_name'], 'test_record_is_encoded_once')
+
+    def test_handler_installed_once(self):
+        Logger()
+        self.assertEqual(len(self.logger._logger.handlers), 1)
+
+    def test_sampling_per_level_and_call_site(self):
+        rates = parse_sample_rates('INFO=0, test_sampling_per_level_and_call_site:WARN=1,WARNING=0.5')
+        self.assertEqual(rates[None, logging.INFO], 0)
+        self.logger._sampler = LogSampler(rates)
+        self.assertEqual(self.logger._sampler.rate(logging.WARNING, 'elsewhere'), 0.5)
+        with self.assertLogs(self.logger._logger, 'INFO') as logs:
+            self.logger.info('sampled out')
+            self.logger.warn('kept by the call site rate')
+            self.logger.error('kept')
+        self.assertEqual([record.msg['message'] for record in logs.records], ['kept by the call site rate', 'kept'])
+        with self.assertRaises(ValueError):
+            parse_sample_rates('LOUD=1')
+
+    def test_repeated_messages_are_rate_limited(self):
+        self.logger._limiter = MessageRateLimiter(rate=1, burst=2)
+        with mock.patch('starwars.logger.time.monotonic', return_value=100.0) as monotonic:
+            with self.assertLogs(self.logger._logger, 'ERROR') as logs:
+                for _ in range(5):
+                    self.logger.error('Movie not found')
+                self.logger.error('Planet not found')
+                monotonic.return_value = 101.0
+                self.logger.error('Movie not found')
+        self.assertEqual(
+            [(record.msg['message'], record.msg.get('suppressed')) for record in logs.records],
+            [('Movie not found', None), ('Movie not found', None), ('Planet not found', None), ('Movie not found', 3)],
+        )
+
+
+class EncodedPageTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.earth = Planets.objects.create(name='Earth', url='http://localhost:8000/planets/1')
+        Planets.objects.create(name='Mars', url='http://localhost:8000/planets/2')
+        FavoritePlanets.objects.create(user_id=1, planet=self.earth, custom_name='Home')
+        self.url = reverse('planet-list')
+
+    def test_dates_match_django_encoder(self):
+        for value in (datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc), datetime(2023, 1, 2, 3, 4, 5)):
+            self.assertEqual(json.dumps(format_datetime(value)), json.dumps(value, cls=DjangoJSONEncoder))
+
+    def test_cached_rows_are_not_encoded_again(self):
+        self.client.get(self.url)
+        with mock.patch('core.lists.dumps', wraps=dumps) as encode:
+            response = self.client.get(self.url, {'user_id': 2})
+            # only the next page link is encoded for a user without favorites on the page
+            self.assertEqual(encode.call_count, 1)
+            content = json.loads(self.client.get(self.url, {'user_id': 1}).content)
+            # and the favorite rows for a user with some
+            self.assertEqual(encode.call_count, 3)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual([planet['name'] for planet in content['results']], ['Mars', 'Home'])
+
+    def test_django_encoder(self):
+        expected = json.loads(self.client.get(self.url, {'user_id': 1}).content)
+        list_cache.clear()
+        get_dumps.cache_clear()
+        try:
+            with override_settings(JSON_ENCODER='core.encoding.django_dumps'):
+                self.assertEqual(json.loads(self.client.get(self.url, {'user_id': 1}).content), expected)
+        finally:
+            get_dumps.cache_clear()
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        metrics.clear()
+        Planets.objects.create(name='Earth', url='http://localhost:8000/planets/1')
+        self.url = reverse('planet-list')
+
+    def sample(self, lines, name):
+        return float(next(line.rsplit(' ', 1)[1] for line in lines if line.startswith(name + ' ')))
+
+    def test_list_requests(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertEqual(self.sample(lines, 'starwars_http_requests_total{view="planet-list",status="200"}'), 2)
+        self.assertEqual(self.sample(lines, 'starwars_http_requests_total{view="planet-list",status="400"}'), 1)
+        bucket = 'starwars_http_request_duration_seconds_bucket{view="planet-list",le="+Inf"}'
+        self.assertEqual(self.sample(lines, bucket), 3)
+        self.assertEqual(self.sample(lines, 'starwars_http_request_duration_seconds_count{view="planet-list"}'), 3)
+        # only the first request queried the database, the second one was a cache hit
+        self.assertEqual(self.sample(lines, 'starwars_db_queries_total{view="planet-list"}'), 1)
+        self.assertEqual(
+            self.sample(lines, 'starwars_list_cache_events_total{view="planet-list",event="local_hits"}'), 1,
+        )
+        self.assertFalse(any(line.startswith('starwars_list_cache_events_total{view="metrics"') for line in lines))
+
+    async def test_async_requests(self):
+        await self.async_client.get(self.url)
+        lines = metrics.render().splitlines()
+        self.assertEqual(self.sample(lines, 'starwars_http_requests_total{view="planet-list",status="200"}'), 1)
+        # queries run in the sync_to_async thread are counted for the request as well
+        self.assertEqual(self.sample(lines, 'starwars_db_queries_total{view="planet-list"}'), 1)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class BenchmarkCommandTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        metrics.clear()
+        for i in range(5):
+            Planets.objects.create(name='Planet {}'.format(i), url='https://swapi.dev/api/planets/{}/'.format(i))
+        Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'results.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def benchmark(self, *args):
+        call_command('benchmark', *args, stdout=StringIO())
+        with open(self.output) as output:
+            return json.load(output)
+
+    def test_synthetic_traffic(self):
+        results = self.benchmark('--requests', '60', '--users', '3', '--seed', '1', '--output', self.output)
+        self.assertEqual(results['requests'], 60)
+        self.assertEqual(set(results['endpoints']), {
+            'planet-list', 'movie-list', 'add_favorite_planet', 'add_favorite_movie',
+        })
+        planets = results['endpoints']['planet-list']
+        self.assertEqual(planets['errors'], 0)
+        self.assertLessEqual(planets['p50_ms'], planets['p99_ms'])
+        self.assertGreater(results['cache_hit_ratio'], 0)
+        self.assertGreater(planets['cache_hit_ratio'], 0)
+        self.assertIsNone(results['endpoints']['add_favorite_planet']['cache_hit_ratio'])
+
+    def test_replay_and_regression_threshold(self):
+        traffic = os.path.join(self.directory.name, 'traffic.ndjson')
+        with open(traffic, 'w') as lines:
+            lines.write(json.dumps({'path': '/core/planets/', 'params': {'search_by': 'net'}}) + '\n')
+            lines.write(json.dumps({'method': 'POST', 'path': '/core/favourite/planet',
+                                    'data': {'name': 'Planet 1', 'user_id': 1}}) + '\n')
+        results = self.benchmark('--replay', traffic, '--output', self.output)
+        self.assertEqual(results['endpoints']['planet-list']['requests'], 1)
+        self.assertEqual(FavoritePlanets.objects.get().planet.name, 'Planet 1')
+
+        results['endpoints']['planet-list']['p95_ms'] = 0.0001
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        with open(baseline, 'w') as output:
+            json.dump(results, output)
+        with self.assertRaisesMessage(CommandError, 'planet-list: p95'):
+            call_command('benchmark', '--replay', traffic, '--baseline', baseline, stdout=StringIO())
+
+
+class GenerateFixturesTestCase(TestCase):
+    def generate(self, **options):
+        options = dict({'planets': 50, 'movies': 5, 'users': 20, 'favorite_planets': 300, 'favorite_movies': 40,
+                        'seed': 7, 'batch_size': 64}, **options)
+        call_command('generate_fixtures', stdout=StringIO(), **options)
+        return sorted(FavoritePlanets.objects.values_list('user_id', 'planet__name', 'custom_name'))
+
+    def test_volumes_and_skew(self):
+        favorites = self.generate()
+        self.assertEqual((Planets.objects.count(), Movies.objects.count()), (50, 5))
+        self.assertEqual((len(favorites), FavoriteMovies.objects.count()), (300, 40))
+        per_user = Counter(user_id for user_id, name, custom_name in favorites)
+        self.assertEqual(per_user.most_common(1)[0][0], 1)
+        self.assertLessEqual(max(per_user.values()), 50)
+        self.assertTrue(any(custom_name for user_id, name, custom_name in favorites))
+
+    def test_seeded(self):
+        favorites = self.generate()
+        for model in (FavoritePlanets, FavoriteMovies, Planets, Movies):
+            model.objects.all().delete()
+        self.assertEqual(self.generate(), favorites)
+        self.assertNotEqual(self.generate(planets=0, movies=0, seed=8), favorites)
+
+    def test_too_many_favorites(self):
+        with self.assertRaises(CommandError):
+            self.generate(movies=2, users=3, favorite_movies=7)
+
+    def test_retires_cached_versions(self):
+        list_cache.clear()
+        versions = list_versions(Planets, 1)
+        self.generate(users=30, favorite_planets=10, skew=2)
+        catalog_version, favorites_version = list_versions(Planets, 1)
+        self.assertGreater(catalog_version, versions[0])
+        self.assertGreater(favorites_version, versions[1])
+        # counters nobody read are left missing, rather than created for every generated user
+        self.assertIsNone(cache.get(favorites_version_key(Planets, 2)))
+
+
+class QueryCountTestCase(TestCase):
+    """
+        The number of queries of every endpoint, on a cold list cache, must not grow with the catalog and favorites.
+    """
+
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        planet = Planets.objects.create(name='Tatooine', url='https://swapi.dev/api/planets/1/')
+        movie = Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+        FavoritePlanets.objects.create(user_id=1, planet=planet, custom_name='Home')
+        FavoriteMovies.objects.create(user_id=1, movie=movie, custom_title='Hope')
+        # probed once per process
+        search_indexes_available()
+
+    def endpoint_queries(self, run):
+        """
+            Returns the number of queries of every endpoint; favorites are added for users specific to the run.
+        """
+        counts = {}
+        for view, field, search in (('planet-list', 'name', 'Home'), ('movie-list', 'title', 'Hope')):
+            url = reverse(view)
+            cursor = parse_qs(urlsplit(json.loads(self.client.get(url).content)['next_page'] or '').query).get('cursor')
+            for name, params in (
+                ('anonymous', {}),
+                ('user', {'user_id': 1}),
+                ('search', {'user_id': 1, 'search_by': 'an'}),
+                ('custom name search', {'user_id': 1, 'search_by': search}),
+                ('cursor', {'user_id': 1, 'cursor': cursor[0] if cursor else ''}),
+            ):
+                list_cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts[view, name] = len(queries)
+
+        name_indexes[Planets].lookup('Tatooine')
+        name_indexes[Movies].lookup('A New Hope')
+        for view, data in (
+            ('add_favorite_planet', {'name': 'Tatooine', 'user_id': 100 + run}),
+            ('add_favorite_movie', {'title': 'A New Hope', 'user_id': 100 + run}),
+            ('add_favorite_planets_batch', {'user_id': 200 + run, 'items': [
+                {'name': name} for name in Planets.objects.values_list('name', flat=True)[:run * 5 + 1]
+            ]}),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse(view), data, format='json')
+            self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_201_CREATED))
+            counts[view] = len(queries)
+        return counts
+
+    maxDiff = None
+
+    def test_query_counts_do_not_depend_on_volume(self):
+        small = self.endpoint_queries(0)
+        call_command('generate_fixtures', planets=200, movies=40, users=20, favorite_planets=1000,
+                     favorite_movies=200, seed=3, stdout=StringIO())
+        self.assertEqual(self.endpoint_queries(1), small)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+class QueryPlanTestCase(TestCase):
+    """
+        The hot queries of the list and favorite endpoints must be answered from an index: every table must be
+        searched, a plan scanning a whole table or index fails. Only the ordered and limited page queries may walk an
+        index in order, as they stop after one page, and trigram search indexes are scanned by design.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_fixtures', planets=300, movies=30, users=10, favorite_planets=600, favorite_movies=60,
+                     seed=5, stdout=StringIO())
+
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        # the name index is built with one pass over the catalog per catalog version, by design
+        name_indexes[Planets].lookup('')
+        name_indexes[Movies].lookup('')
+
+    def assert_indexed(self, queries):
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            page_query = re.search(r'\bORDER BY\b.*\bLIMIT \d+$', sql, re.DOTALL)
+            scans = [
+                detail for detail in plan
+                if detail.startswith('SCAN ') and not re.search(r'VIRTUAL TABLE|CONSTANT ROW', detail)
+                and not (page_query and re.search(r' USING (COVERING )?INDEX ', detail))
+            ]
+            self.assertEqual(scans, [], 'Scan in the plan of {}:\n{}'.format(sql, '\n'.join(plan)))
+
+    def test_index_walks_outside_pages_fail(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Planets.objects.order_by('created_at', 'id').values_list('created_at', 'id'))
+        with self.assertRaisesRegex(AssertionError, 'USING COVERING INDEX planets_created_at_id'):
+            self.assert_indexed(queries)
+
+    def test_list_plans(self):
+        custom_name = FavoritePlanets.objects.filter(user_id=1).exclude(custom_name=None).values_list(
+            'custom_name', flat=True).first()
+        for params in ({}, {'user_id': 1}, {'user_id': 1, 'search_by': 'tan'}, {'user_id': 1, 'search_by': custom_name}):
+            list_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                content = json.loads(self.client.get(reverse('planet-list'), params).content)
+            self.assertTrue(content['results'])
+            self.assert_indexed(queries)
+
+        list_cache.clear()
+        next_page = json.loads(self.client.get(reverse('movie-list'), {'user_id': 2}).content)['next_page']
+        with CaptureQueriesContext(connection) as queries:
+            content = json.loads(self.client.get(next_page).content)
+        self.assertTrue(content['results'])
+        self.assert_indexed(queries)
+
+    def test_top_plans(self):
+        for view in ('top-planets', 'top-movies'):
+            with CaptureQueriesContext(connection) as queries:
+                content = json.loads(self.client.get(reverse(view)).content)
+            self.assertTrue(content['results'])
+            self.assert_indexed(queries)
+
+    def test_favorite_plans(self):
+        name = Planets.objects.last().name
+        items = [{'title': title} for title in Movies.objects.values_list('title', flat=True)[:5]]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_favorite_planet'), {'name': name, 'user_id': 1})
+            self.client.post(reverse('add_favorite_movies_batch'), {'user_id': 3, 'items': items}, format='json')
+        self.assert_indexed(queries)
+
+
+class WarmUpTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        for model in name_indexes.values():
+            model.clear()
+        Planets.objects.bulk_create([
+            Planets(name='Planet {:02d}'.format(i), url='https://swapi.dev/api/planets/{}/'.format(i)) for i in range(25)
+        ])
+        Movies.objects.create(title='A New Hope', release_date='1977-05-25', url='https://swapi.dev/api/films/1/')
+
+    def test_warm_up_caches_first_pages_and_indexes(self):
+        self.assertEqual(warm_up(pages=2), {'planets': 2, 'movies': 1})
+        with self.assertNumQueries(0):
+            content = json.loads(self.client.get(reverse('planet-list')).content)
+            content = json.loads(self.client.get(content['next_page']).content)
+            self.assertIsNotNone(name_indexes[Movies].lookup('a new hope'))
+        self.assertEqual(len(content['results']), 10)
+        with self.assertNumQueries(1):
+            self.client.get(content['next_page'])
+
+    def test_warm_up_command(self):
+        output = StringIO()
+        call_command('warm_up', pages=1, stdout=output)
+        self.assertIn('planets: 1 pages cached', output.getvalue())
+
+    def test_liveness_and_readiness(self):
+        self.assertEqual(self.client.get(reverse('knockknock')).status_code, status.HTTP_200_OK)
+        with mock.patch('core.warmup._warm', threading.Event()):
+            # a failed warm-up leaves the process not ready, the next probe tries again
+            with mock.patch('core.warmup.warm_up', side_effect=DatabaseError('locked')):
+                response = self.client.get(reverse('readiness'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(json.loads(response.content), {'warm': False, 'database': True, 'status': 'not ready'})
+            # a process not warmed up by the gunicorn hooks (runserver, ASGI) warms itself up when probed
+            response = self.client.get(reverse('readiness'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertNumQueries(0):
+                self.assertIsNotNone(name_indexes[Movies].lookup('a new hope'))
+
+
+class DatabaseRoutingTestCase(TransactionTestCase):
+    """
+        Runs outside of any transaction, unlike TestCase, so the reads are really routed to the reader connection, which
+        refuses writes: a write sent to it fails the tests.
+    """
+    databases = {'default', READ_ALIAS}
+
+    def setUp(self):
+        list_cache.clear()
+        for index in name_indexes.values():
+            index.clear()
+        self.planet = Planets.objects.create(name='Hoth', url='https://swapi.dev/api/planets/4/')
+        self.movie = Movies.objects.create(title='A New Hope', release_date='1977-05-25',
+                                           url='https://swapi.dev/api/films/1/')
+
+    def test_reads_go_to_the_reader_outside_transactions(self):
+        planet = Planets.objects.get(id=self.planet.id)
+        self.assertEqual(planet._state.db, READ_ALIAS)
+        with self.assertRaises(DatabaseError):
+            Planets.objects.using(READ_ALIAS).create(name='Endor', url='https://swapi.dev/api/planets/7/')
+        # reads made in a transaction stay on the default connection, to see its writes
+        with transaction.atomic():
+            self.assertEqual(Planets.objects.all().db, 'default')
+        # rows read from the reader are written through the default connection
+        planet.name = 'Ice'
+        planet.save()
+        FavoritePlanets.objects.create(user_id=1, planet=planet)
+        self.assertEqual(Planets.objects.get(id=planet.id).name, 'Ice')
+        self.assertEqual(Planets.objects.get(id=planet.id).favorite_count, 1)
+
+    def test_endpoints_read_from_the_reader(self):
+        client = APIClient()
+        with CaptureQueriesContext(connections[READ_ALIAS]) as reads:
+            for url, data in (
+                (reverse('add_favorite_planet'), {'name': 'hoth', 'user_id': 1, 'custom_name': 'Cold'}),
+                (reverse('add_favorite_movie'), {'title': 'a new hope', 'user_id': 1}),
+                (reverse('add_favorite_movies_batch'), {'user_id': 2, 'items': [{'title': 'A New Hope'}]}),
+            ):
+                response = client.post(url, data, format='json')
+                self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_201_CREATED), url)
+            for url in (reverse('planet-list'), reverse('movie-list'), reverse('top-movies')):
+                response = client.get(url, {'user_id': 1})
+                self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            response = client.get(reverse('planet-list'), {'user_id': 1, 'search_by': 'cold'})
+        self.assertTrue(reads.captured_queries)
+        self.assertEqual(json.loads(response.content)['results'][0]['is_favourite'], True)
+        self.assertEqual(Movies.objects.get().favorite_count, 2)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite tuning')
+    def test_sqlite_connections_use_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            writer = DatabaseWrapper(dict(connection.settings_dict, NAME=path), alias='writer')
+            reader = DatabaseWrapper(
+                dict(connection.settings_dict, NAME='file:{}?mode=ro'.format(path), OPTIONS={'uri': True}),
+                alias='read-only',
+            )
+            try:
+                with writer.cursor() as cursor:
+                    cursor.execute('CREATE TABLE counter (value INTEGER)')
+                    cursor.execute('INSERT INTO counter VALUES (1)')
+                    self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+                    self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone(), (1,))
+                # transactions hold the write lock from their start
+                writer._start_transaction_under_autocommit()
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    sqlite3.connect(path, timeout=0).execute('BEGIN IMMEDIATE')
+                # a reader is not blocked by a pending write, and reads the last committed state
+                with writer.cursor() as cursor:
+                    cursor.execute('INSERT INTO counter VALUES (2)')
+                    with reader.cursor() as read_cursor:
+                        self.assertEqual(read_cursor.execute('SELECT COUNT(*) FROM counter').fetchone(), (1,))
+                        with self.assertRaises(Exception):
+                            read_cursor.execute('INSERT INTO counter VALUES (3)')
+                    cursor.execute('COMMIT')
+            finally:
+                writer.close()
+                reader.close()
+
+
+class FavoriteBufferTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        self.earth = Planets.objects.create(name='Earth', url='https://swapi.dev/api/planets/1/')
+        self.mars = Planets.objects.create(name='Mars', url='https://swapi.dev/api/planets/2/')
+        self.hoth = Planets.objects.create(name='Hoth', url='https://swapi.dev/api/planets/3/')
+        FavoritePlanets.objects.create(user_id=1, planet=self.earth)
+        self.buffer = FavoriteBuffer(True, flush_size=100, flush_interval=0)
+        for module in ('core.favorites', 'core.views'):
+            patcher = mock.patch(module + '.favorite_buffer', self.buffer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add(self, name, **data):
+        return self.client.post(reverse('add_favorite_planet'), dict(data, name=name, user_id=1), format='json')
+
+    def list_favorites(self):
+        content = json.loads(self.client.get(reverse('planet-list'), {'user_id': 1}).content)
+        return sorted(planet['name'] for planet in content['results'] if planet['is_favourite'])
+
+    def test_answers_from_pending_and_committed_favorites(self):
+        response = self.add('Mars', custom_name='Red')
+        self.assertEqual((response.status_code, response.data['favorite_planet']), (status.HTTP_201_CREATED, None))
+        self.assertEqual(self.add('mars').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.add('Earth').status_code, status.HTTP_200_OK)
+        self.assertEqual(FavoritePlanets.objects.filter(user_id=1).count(), 1)
+        # waiting favorites are already shown by the list pages
+        self.assertEqual(self.list_favorites(), ['Earth', 'Red'])
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(FavoritePlanets.objects.get(user_id=1, planet=self.mars).custom_name, 'Red')
+        self.assertEqual(self.list_favorites(), ['Earth', 'Red'])
+        self.assertEqual(self.add('Mars').status_code, status.HTTP_200_OK)
+
+    def test_flushes_when_full(self):
+        self.buffer.flush_size = 2
+        response = self.client.post(reverse('add_favorite_planets_batch'), {'user_id': 1, 'items': [
+            {'name': 'Mars'}, {'name': 'Hoth'}, {'name': 'hoth'}, {'name': 'Earth'},
+        ]}, format='json')
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'created', 'exists', 'exists'],
+        )
+        self.assertEqual(FavoritePlanets.objects.filter(user_id=1).count(), 3)
+
+    def test_flush_caches_only_the_inserted_favorites(self):
+        self.add('Mars', custom_name='Red')
+        self.assertEqual(self.add('Hoth', custom_name=7).status_code, status.HTTP_400_BAD_REQUEST)
+        # another process adds the same favorite first, under another custom name
+        FavoritePlanets.objects.create(user_id=1, planet=self.mars, custom_name='Dusty')
+        favorites_added(Planets, 1, {self.mars.id: 'Dusty'})
+        self.buffer.flush()
+        self.assertEqual(FavoritePlanets.objects.get(user_id=1, planet=self.mars).custom_name, 'Dusty')
+        self.assertEqual(self.list_favorites(), ['Dusty', 'Earth'])
+
+    def test_failed_flush_is_retried(self):
+        self.add('Mars')
+        with mock.patch.object(FavoritePlanets.objects, 'bulk_create', side_effect=DatabaseError):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.add('Mars').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.list_favorites(), ['Earth', 'Mars'])
+        self.buffer.close()
+        self.assertEqual(FavoritePlanets.objects.filter(user_id=1).count(), 2)
+
+
+class FavoriteSetTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        self.earth = Planets.objects.create(name='Earth', url='https://swapi.dev/api/planets/1/')
+        self.mars = Planets.objects.create(name='Mars', url='https://swapi.dev/api/planets/2/')
+        FavoritePlanets.objects.create(user_id=1, planet=self.earth, custom_name='Home')
+
+    def test_sparse_bitset(self):
+        ids = [0, 1, 4095, 4096, 10 ** 6, 2 ** 40 + 3]
+        bitset = SparseBitset(ids + [1])
+        self.assertEqual((list(bitset), len(bitset)), (ids, len(ids)))
+        self.assertTrue(all(value in bitset for value in ids))
+        self.assertFalse(any(value in bitset for value in (2, 4097, 10 ** 6 + 1, 2 ** 40, -1, 'a')))
+        # 8 bytes per sparse id whatever its value, less than a set takes; one bit per id in dense ranges
+        sparse = range(3, 10 ** 6, 20011)
+        self.assertLess(SparseBitset(sparse).nbytes(), sys.getsizeof(set(sparse)))
+        self.assertLess(SparseBitset([2 ** 40]).nbytes(), 200)
+        self.assertLess(SparseBitset(range(100000)).nbytes(), 20000)
+        with self.assertRaises(ValueError):
+            bitset.add(-1)
+        with self.assertRaises(ValueError):
+            bitset.update([5, -1])
+
+    def test_sparse_bitset_moves_dense_chunks_to_bitmaps(self):
+        ids = [5] + list(range(8192, 8192 + 4096, 7)) + [10 ** 6, 2 ** 40]
+        bitset = SparseBitset()
+        for value in reversed(ids):
+            bitset.add(value)
+        bitset.add(8192)
+        self.assertEqual((list(bitset), len(bitset)), (ids, len(ids)))
+        self.assertTrue(all(value in bitset for value in ids))
+        self.assertFalse(any(value in bitset for value in (8193, 8192 + 4096, 10 ** 6 - 1)))
+        self.assertLess(bitset.nbytes(), len(ids) * 8)
+        # built at once or id by id, the ids end up in the same places
+        built = SparseBitset(ids)
+        self.assertEqual((list(built._ids), set(built._chunks)), (list(bitset._ids), set(bitset._chunks)))
+        self.assertEqual(list(bitset._ids), [5, 10 ** 6, 2 ** 40])
+        copy = bitset.copy()
+        copy.add(8193)
+        self.assertEqual((8193 in copy, 8193 in bitset, len(copy)), (True, False, len(ids) + 1))
+
+    def test_added_returns_a_copy(self):
+        favorites = FavoriteSet([(1, 'Home'), (2, None)])
+        added = favorites.added({3: 'Red', 1: None})
+        self.assertEqual((2 in favorites, 3 in favorites, favorites.get(1)), (True, False, 'Home'))
+        self.assertEqual((len(added), added.get(1), added.get(3), 4 in added), (3, None, 'Red', False))
+
+    def test_non_string_custom_names_are_rejected(self):
+        url = reverse('planet-list')
+        self.client.get(url, {'user_id': 1})
+        response = self.client.post(reverse('add_favorite_planet'), {'name': 'Mars', 'user_id': 1, 'custom_name': 42},
+                                    format='json')
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Invalid custom name'))
+        request = AsyncRequestFactory().post(reverse('add_favorite_planet'), {'name': 'Mars', 'user_id': 1,
+                                             'custom_name': 42}, content_type='application/json')
+        self.assertEqual(async_to_sync(async_views.add_favorite_planet)(request).status_code, 400)
+        response = self.client.post(reverse('add_favorite_planets_batch'), {
+            'user_id': 1, 'items': [{'name': 'Mars', 'custom_name': 42}, {'name': 'Earth', 'custom_name': 'Home'}],
+        }, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], ['invalid', 'exists'])
+        self.assertFalse(FavoritePlanets.objects.filter(planet=self.mars).exists())
+        # the cached favorites only hold string custom names, which searches match against
+        response = self.client.get(url, {'user_id': 1, 'search_by': '4'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['results'], [])
+
+    def test_add_updates_the_cached_favorites(self):
+        url = reverse('planet-list')
+        self.client.get(url, {'user_id': 1})
+        self.client.post(reverse('add_favorite_planet'), {'name': 'Mars', 'user_id': 1, 'custom_name': 'Red'})
+        # the catalog page and the favorites are cached, the new favorite is marked without any query
+        with self.assertNumQueries(0):
+            content = json.loads(self.client.get(url, {'user_id': 1}).content)
+        self.assertEqual(
+            [(planet['name'], planet['is_favourite']) for planet in content['results']],
+            [('Red', True), ('Home', True)],
+        )
+        stats = json.loads(self.client.get(reverse('cache-stats')).content)['favorite_sets']
+        # the set cached under the previous version stays until evicted
+        self.assertEqual(stats['entries'], 2)
+        self.assertGreater(stats['max_bytes'], 0)
+
+    def test_concurrent_write_reloads_the_favorites(self):
+        self.client.get(reverse('planet-list'), {'user_id': 1})
+        # another process moved the version after the favorites were cached: they are loaded again
+        with mock.patch('core.favorites.bump_version', side_effect=lambda key: bump_version(key) + 1):
+            self.client.post(reverse('add_favorite_planet'), {'name': 'Mars', 'user_id': 1})
+        with self.assertNumQueries(1):
+            favorites = get_favorites(Planets, 1, list_versions(Planets, 1)[1])
+        self.assertEqual(list(favorites), [self.earth.id, self.mars.id])
+
+
+class FavoriteCountTestCase(TestCase):
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        self.planets = [
+            Planets.objects.create(name=name, url='https://swapi.dev/api/planets/{}/'.format(number))
+            for number, name in enumerate(('Tatooine', 'Hoth', 'Dagobah'), start=1)
+        ]
+
+    def counts(self):
+        return list(Planets.objects.order_by('id').values_list('favorite_count', flat=True))
+
+    def test_adds_and_deletes_are_counted(self):
+        for user_id in (1, 2):
+            self.client.post(reverse('add_favorite_planet'), {'name': 'Hoth', 'user_id': user_id})
+        self.client.post(reverse('add_favorite_planet'), {'name': 'Hoth', 'user_id': 1})
+        self.client.post(reverse('add_favorite_planets_batch'), {'user_id': 1, 'items': [
+            {'name': 'Hoth'}, {'name': 'Dagobah'}, {'name': 'dagobah'},
+        ]}, format='json')
+        self.assertEqual(self.counts(), [0, 2, 1])
+        FavoritePlanets.objects.filter(user_id=1).delete()
+        self.assertEqual(self.counts(), [0, 1, 0])
+
+    def test_buffered_favorites_are_counted_once(self):
+        buffer = FavoriteBuffer(True, flush_size=100, flush_interval=0)
+        FavoritePlanets.objects.create(user_id=2, planet=self.planets[0])
+        # the buffer of another process may hold a favorite that was written meanwhile
+        buffer.add(Planets, 1, {self.planets[0].id: None, self.planets[1].id: None})
+        buffer.add(Planets, 2, {self.planets[1].id: 'Cold'})
+        FavoritePlanets.objects.create(user_id=1, planet=self.planets[0])
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.counts(), [2, 2, 0])
+
+    def test_top_endpoints(self):
+        for user_id, planet in ((1, 1), (2, 1), (3, 1), (1, 2)):
+            FavoritePlanets.objects.create(user_id=user_id, planet=self.planets[planet])
+        content = json.loads(self.client.get(reverse('top-planets')).content)
+        self.assertEqual(
+            [(planet['name'], planet['favorite_count']) for planet in content['results']],
+            [('Hoth', 3), ('Dagobah', 1)],
+        )
+        content = json.loads(self.client.get(reverse('top-planets'), {'limit': 1}).content)
+        self.assertEqual([planet['name'] for planet in content['results']], ['Hoth'])
+        self.assertEqual(json.loads(self.client.get(reverse('top-movies')).content), {'results': []})
+        for limit in ('0', 'ten', TOP_FAVORITES_LIMIT + 1):
+            response = self.client.get(reverse('top-planets'), {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reconcile_command(self):
+        FavoritePlanets.objects.bulk_create([
+            FavoritePlanets(user_id=user_id, planet=self.planets[2]) for user_id in range(5)
+        ])
+        Planets.objects.filter(id=self.planets[0].id).update(favorite_count=7)
+        output = StringIO()
+        call_command('reconcile_favorite_counts', batch_size=2, stdout=output)
+        self.assertIn('Planets: 2 favorite counts fixed', output.getvalue())
+        self.assertEqual(self.counts(), [0, 0, 5])
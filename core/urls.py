@@ -1,9 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from .views import  add_favorite_planet, add_favorite_movie, get_planet_list, get_movie_list
+
+from . import async_views, views
+
+# the list and add-favorite endpoints have native async versions for ASGI deployments
+entry_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('favourite/movie', add_favorite_movie, name='add_favorite_movie'),
-    path('favourite/planet', add_favorite_planet, name='add_favorite_planet'),
-    path('movies/', get_movie_list, name='movie-list'),
-    path('planets/', get_planet_list, name='planet-list'),
-]
\ No newline at end of file
+    path('favourite/movie', entry_views.add_favorite_movie, name='add_favorite_movie'),
+    path('favourite/planet', entry_views.add_favorite_planet, name='add_favorite_planet'),
+    path('favourite/movies/batch', views.add_favorite_movies_batch, name='add_favorite_movies_batch'),
+    path('favourite/planets/batch', views.add_favorite_planets_batch, name='add_favorite_planets_batch'),
+    path('movies/', entry_views.get_movie_list, name='movie-list'),
+    path('planets/', entry_views.get_planet_list, name='planet-list'),
+    path('movies/top', views.get_top_movies, name='top-movies'),
+    path('planets/top', views.get_top_planets, name='top-planets'),
+    path('cache/stats', views.get_cache_stats, name='cache-stats'),
+]
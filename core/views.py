@@ -1,14 +1,20 @@
-from django.core.cache import cache
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Case, When
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Movies, Planets, FavoriteMovies, FavoritePlanets
+from .models import Movies, Planets
+from .caching import list_cache, list_versions
+from .catalog import name_indexes
+from .favorites import (
+    FAVORITE_BATCH_LIMIT, FAVORITE_FIELDS, TOP_FAVORITES_LIMIT, favorite_buffer, favorite_set_stats, favorites_added,
+    get_favorites, insert_favorites, matches_custom_name,
+)
+from .lists import (
+    build_page, catalog_page_key, list_response, movie_queryset, movie_row, overlay_fragments, planet_queryset,
+    planet_row, top_queryset, top_row, user_movie_queryset, user_page_key, user_planet_queryset,
+)
+from .pagination import InvalidCursor, paginate
+from django.db import transaction
 from django.http import JsonResponse
-from django.core.paginator import Paginator
-from django.urls import reverse
-from django.db import models
 
 from starwars.logger import Logger
 
@@ -33,7 +39,7 @@ def add_favorite_movie(request):
 
         HTTP status codes:
         - 201 Created: the movie was successfully added as a favorite
-        - 400 Bad Request: required data is missing from the request
+        - 400 Bad Request: required data is missing from the request or invalid
         - 404 Not Found: the movie with the given title could not be found
         - 200 OK: the movie was already added as a favorite
     """
@@ -48,28 +54,30 @@ def add_favorite_movie(request):
         logger.error(msg='Missing required data: {} and {}'.format(movie_title, user_id))
         return Response({'error': 'Missing required data'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Check if movie with given title exists
-    try:
-        movie = Movies.objects.get(title__iexact=movie_title)
-    except ObjectDoesNotExist:
+    if not isinstance(movie_title, str):
+        logger.error(msg='Invalid title: {!r}'.format(movie_title))
+        return Response({'error': 'Invalid title'}, status=status.HTTP_400_BAD_REQUEST)
+    if custom_title is not None and not isinstance(custom_title, str):
+        logger.error(msg='Invalid custom title: {!r}'.format(custom_title))
+        return Response({'error': 'Invalid custom title'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Check if movie with given title exists, from the in-memory title index
+    movie_id = name_indexes[Movies].lookup(movie_title)
+    if movie_id is None:
         logger.error(msg='Movie not found, movie title: {}'.format(movie_title))
         return Response({'error': 'Movie not found'}, status=status.HTTP_404_NOT_FOUND)
 
     # Create favorite movie object
-    favorite_movie, is_created = FavoriteMovies.objects.get_or_create(
-        user_id=user_id,
-        movie=movie,
-        defaults={'custom_title': custom_title},
-    )
+    favorite_movie_id, is_created = _add_favorite(Movies, user_id, movie_id, custom_title)
 
     if not is_created:
         logger.warn(msg='Movie already added as favorite, movie title: {}'.format(movie_title))
-        return Response({'success': 'Movie already added as favorite', 'favorite_movie': favorite_movie.id},
+        return Response({'success': 'Movie already added as favorite', 'favorite_movie': favorite_movie_id},
                         status=status.HTTP_200_OK)
 
     # Return success response with created favorite movie object
     logger.info(msg='Movie added as favorite, movie title: {}'.format(movie_title))
-    return Response({'success': 'Movie added as favorite', 'favorite_movie': favorite_movie.id},
+    return Response({'success': 'Movie added as favorite', 'favorite_movie': favorite_movie_id},
                     status=status.HTTP_201_CREATED)
 
 
@@ -90,7 +98,7 @@ def add_favorite_planet(request):
 
         HTTP status codes:
         - 201 Created: the planet was successfully added as a favorite
-        - 400 Bad Request: required data is missing from the request
+        - 400 Bad Request: required data is missing from the request or invalid
         - 404 Not Found: the planet with the given name could not be found
         - 200 OK: the planet was already added as a favorite
     """
@@ -104,87 +112,205 @@ def add_favorite_planet(request):
         logger.error(msg='Missing required data: {} and {}'.format(planet_name, user_id))
         return Response({'error': 'Missing required data'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        planet = Planets.objects.get(name__iexact=planet_name)
-    except ObjectDoesNotExist:
+    if not isinstance(planet_name, str):
+        logger.error(msg='Invalid name: {!r}'.format(planet_name))
+        return Response({'error': 'Invalid name'}, status=status.HTTP_400_BAD_REQUEST)
+    if custom_name is not None and not isinstance(custom_name, str):
+        logger.error(msg='Invalid custom name: {!r}'.format(custom_name))
+        return Response({'error': 'Invalid custom name'}, status=status.HTTP_400_BAD_REQUEST)
+
+    planet_id = name_indexes[Planets].lookup(planet_name)
+    if planet_id is None:
         logger.error(msg='Planet not found, movie title: {}'.format(planet_name))
         return Response({'error': 'Planet not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    favorite_planet, is_created = FavoritePlanets.objects.get_or_create(
-        user_id=user_id,
-        planet=planet,
-        defaults={'custom_name': custom_name},
-    )
+    favorite_planet_id, is_created = _add_favorite(Planets, user_id, planet_id, custom_name)
 
     if not is_created:
         logger.warn(msg='Planet already added as favorite, planet name: {}'.format(planet_name))
-        return Response({'success': 'Planet already added as favorite', 'favorite_planet': favorite_planet.id},
+        return Response({'success': 'Planet already added as favorite', 'favorite_planet': favorite_planet_id},
                         status=status.HTTP_200_OK)
 
     logger.info(msg='Planet added as favorite, planet name: {}'.format(planet_name))
-    return Response({'success': 'Planet added as favorite', 'favorite_planet': favorite_planet.id},
+    return Response({'success': 'Planet added as favorite', 'favorite_planet': favorite_planet_id},
                     status=status.HTTP_201_CREATED)
 
 
+def _add_favorite(model, user_id, catalog_id, custom_name):
+    """
+        Adds a favorite of the given catalog model, and returns its id and whether it was created. With the
+        write-behind buffer enabled the favorite is only queued, and its id is not known yet (None).
+    """
+    if favorite_buffer.enabled:
+        return None, catalog_id in favorite_buffer.add(model, user_id, {catalog_id: custom_name})
+    favorite_model, id_field, name_field = FAVORITE_FIELDS[model]
+    favorite, is_created = favorite_model.objects.get_or_create(
+        user_id=user_id,
+        **{id_field: catalog_id},
+        defaults={name_field: custom_name},
+    )
+    if is_created:
+        favorites_added(model, user_id, {catalog_id: custom_name})
+    return favorite.id, is_created
+
+
+@api_view(['POST'])
+def add_favorite_movies_batch(request):
+    """
+        Add several movies as favorites for a user in one request.
+
+        Required request parameters:
+        - user_id: the ID of the user adding the movies as favorites
+        - items: a list of at most FAVORITE_BATCH_LIMIT objects, each with the `title` of a movie and an optional
+          `custom_title`
+
+        All titles are resolved at once and the new favorites are inserted with a single bulk insert. Returns a JSON
+        response with one result per item, in request order, whose status is `created`, `exists`, `not_found` or
+        `invalid` (no title given, or a custom title that is not a string).
+
+        HTTP status codes:
+        - 200 OK: the batch was processed, see the per-item results
+        - 400 Bad Request: required data is missing from the request or invalid or the batch is too large
+    """
+    return _add_favorites_batch(request, Movies, 'title')
+
+
+@api_view(['POST'])
+def add_favorite_planets_batch(request):
+    """
+        Add several planets as favorites for a user in one request.
+
+        Required request parameters:
+        - user_id: the ID of the user adding the planets as favorites
+        - items: a list of at most FAVORITE_BATCH_LIMIT objects, each with the `name` of a planet and an optional
+          `custom_name`
+
+        All names are resolved at once and the new favorites are inserted with a single bulk insert. Returns a JSON
+        response with one result per item, in request order, whose status is `created`, `exists`, `not_found` or
+        `invalid` (no name given, or a custom name that is not a string).
+
+        HTTP status codes:
+        - 200 OK: the batch was processed, see the per-item results
+        - 400 Bad Request: required data is missing from the request or invalid or the batch is too large
+    """
+    return _add_favorites_batch(request, Planets, 'name')
+
+
+def _add_favorites_batch(request, model, name_key):
+    custom_name_field = FAVORITE_FIELDS[model][2]
+    user_id = request.data.get('user_id')
+    items = request.data.get('items')
+
+    logger.info(msg='adding {} {} favorites for user: {}'.format(
+        len(items) if isinstance(items, list) else 0, model._meta.model_name, user_id,
+    ))
+
+    if not user_id or not isinstance(items, list) or not items:
+        logger.error(msg='Missing required data: {} and {}'.format(user_id, items))
+        return Response({'error': 'Missing required data'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > FAVORITE_BATCH_LIMIT:
+        logger.error(msg='Too many items: {}'.format(len(items)))
+        return Response({'error': 'At most {} items per request'.format(FAVORITE_BATCH_LIMIT)},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    # resolve every name first, then add all the favorites at once
+    index = name_indexes[model]
+    resolved = []
+    for item in items:
+        name = item.get(name_key) if isinstance(item, dict) else None
+        if not _valid_item(item, name, custom_name_field):
+            resolved.append((item, name, None))
+        else:
+            resolved.append((item, name, index.lookup(name)))
+    # the first item naming a catalog row gives its custom name
+    entries = {}
+    for item, name, catalog_id in resolved:
+        if catalog_id is not None:
+            entries.setdefault(catalog_id, item.get(custom_name_field))
+
+    if favorite_buffer.enabled:
+        created = favorite_buffer.add(model, user_id, entries)
+        logger.info(msg='{} {} favorites queued for user: {}'.format(len(created), model._meta.model_name, user_id))
+    else:
+        with transaction.atomic():
+            inserted = insert_favorites(model, [
+                (user_id, catalog_id, custom_name) for catalog_id, custom_name in entries.items()
+            ])
+        if inserted:
+            favorites_added(model, user_id, {catalog_id: custom_name for _, catalog_id, custom_name in inserted})
+        created = {catalog_id for _, catalog_id, _ in inserted}
+        logger.info(msg='{} {} favorites added for user: {}'.format(len(created), model._meta.model_name, user_id))
+
+    results = []
+    for item, name, catalog_id in resolved:
+        if not _valid_item(item, name, custom_name_field):
+            results.append({name_key: name, 'status': 'invalid'})
+        elif catalog_id is None:
+            results.append({name_key: name, 'status': 'not_found'})
+        elif catalog_id in created:
+            created.discard(catalog_id)
+            results.append({name_key: name, 'status': 'created'})
+        else:
+            results.append({name_key: name, 'status': 'exists'})
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+def _valid_item(item, name, custom_name_field):
+    custom_name = item.get(custom_name_field) if isinstance(item, dict) else None
+    return isinstance(name, str) and bool(name) and (custom_name is None or isinstance(custom_name, str))
+
+
 @api_view(['GET'])
 def get_planet_list(request, *args, **kwargs):
     """
         Returns a paginated list of planets, optionally filtered by name or custom name, and annotated with additional
         information about whether each planet is a favorite for a given user.
 
+        The catalog page is cached once for all users; the favorites of the requesting user are cached separately and
+        merged onto it. Only searches matching one of the user's custom names are answered from a per-user query.
+
         Parameters:
         - user_id (str, optional): the ID of the user making the request (passed as a query parameter)
         - search_by (str, optional): the search string to filter by (passed as a query parameter)
-        - page (int, optional): the page number to retrieve (passed as a query parameter)
+        - cursor (str, optional): the opaque cursor of the page to retrieve, taken from next_page (passed as a query
+          parameter)
+        - count (bool, optional): also return the total number of matching planets (passed as a query parameter)
+        - page (int, optional): the page number to retrieve, using page-number pagination instead of cursors (passed
+          as a query parameter)
 
         Returns:
-        - JsonResponse: a JSON response object containing a list of planets and metadata about the next page of results
+        - HttpResponse: a JSON response object containing a list of planets and metadata about the next page of results
     """
     user_id = request.GET.get('user_id')
     query = request.GET.get('search_by')
-    page_number = request.GET.get('page', 1)
-    key = f'planets:{user_id}:{query}:{page_number}'
-    cached_data = cache.get(key)
-    if cached_data:
-        return JsonResponse(cached_data)
-    favourite_planets = FavoritePlanets.objects.filter(user_id=user_id).values_list('planet_id', flat=True)
-    planets = Planets.objects.annotate(
-        custom_name=Case(
-            When(id__in=favourite_planets, then='favoriteplanets__custom_name'),
-            default='name',
-            output_field=models.CharField(),
-        ),
-        is_favourite=Case(
-            When(id__in=favourite_planets, then=models.Value(True)),
-            default=models.Value(False),
-            output_field=models.BooleanField(),
-        ),
-    ).order_by('-created_at')
-    if query:
-        planets = planets.filter(models.Q(name__icontains=query) | models.Q(custom_name__icontains=query))
-    paginator = Paginator(planets, 10)
-    page_obj = paginator.get_page(page_number)
-    response = {
-        'next_page': None,
-        'results': []
-    }
-    if page_obj.has_next():
-        next_url = reverse('planet-list') + '?page=' + str(page_obj.next_page_number())
-        if query:
-            next_url += '&search_by=' + query
-        if user_id:
-            next_url += '&user_id=' + user_id
-        response['next_page'] = next_url
-    for planet in page_obj:
-        response['results'].append({
-            'name': planet.custom_name or planet.name,
-            'created_at': planet.created_at,
-            'updated_at': planet.updated_at,
-            'url': planet.url,
-            'is_favourite': planet.is_favourite
-        })
-    cache.set(key, response, timeout=60 * 5)
-    return JsonResponse(response)
+    catalog_version, favorites_version = list_versions(Planets, user_id)
+    favourite_planets = get_favorites(Planets, user_id, favorites_version)
+    try:
+        if query and matches_custom_name(favourite_planets, query):
+            page = _get_user_planet_page(request, user_id, query, catalog_version, favorites_version, favourite_planets)
+            fragments = page['fragments']
+        else:
+            page = _get_planet_page(request, query, catalog_version)
+            fragments = overlay_fragments(page, favourite_planets, 'name')
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return list_response(request, 'planet-list', page, fragments)
+
+
+def _get_planet_page(request, query, catalog_version):
+    key = catalog_page_key(request, Planets, catalog_version, query)
+    return list_cache.get_or_set(
+        key,
+        lambda: build_page(*paginate(request, planet_queryset(query)), planet_row, 'name'),
+    )
+
+
+def _get_user_planet_page(request, user_id, query, catalog_version, favorites_version, favorites):
+    key = user_page_key(request, Planets, user_id, catalog_version, favorites_version, query)
+    return list_cache.get_or_set(
+        key,
+        lambda: build_page(*paginate(request, user_planet_queryset(user_id, query)), planet_row, 'name', favorites),
+    )
 
 
 @api_view(['GET'])
@@ -193,57 +319,94 @@ def get_movie_list(request, *args, **kwargs):
         Returns a paginated list of movies, optionally filtered by title or custom title, and annotated with additional
         information about whether each movie is a favorite for a given user.
 
+        The catalog page is cached once for all users; the favorites of the requesting user are cached separately and
+        merged onto it. Only searches matching one of the user's custom titles are answered from a per-user query.
+
         Parameters:
         - user_id (str, optional): the ID of the user making the request (passed as a query parameter)
         - search_by (str, optional): the search string to filter by (passed as a query parameter)
-        - page (int, optional): the page number to retrieve (passed as a query parameter)
+        - cursor (str, optional): the opaque cursor of the page to retrieve, taken from next_page (passed as a query
+          parameter)
+        - count (bool, optional): also return the total number of matching movies (passed as a query parameter)
+        - page (int, optional): the page number to retrieve, using page-number pagination instead of cursors (passed
+          as a query parameter)
 
         Returns:
-        - JsonResponse: a JSON response object containing a list of movies and metadata about the next page of results
+        - HttpResponse: a JSON response object containing a list of movies and metadata about the next page of results
     """
     user_id = request.GET.get('user_id')
     query = request.GET.get('search_by')
-    page_number = request.GET.get('page', 1)
-    key = f'movies:{user_id}:{query}:{page_number}'
-    cached_data = cache.get(key)
-    if cached_data:
-        return JsonResponse(cached_data)
-    favorite_movies = FavoriteMovies.objects.filter(user_id=user_id).values_list('movie_id', flat=True)
-    movies = Movies.objects.annotate(
-        custom_title=Case(
-            When(id__in=favorite_movies, then='favoritemovies__custom_title'),
-            default='title',
-            output_field=models.CharField(),
-        ),
-        is_favourite=Case(
-            When(id__in=favorite_movies, then=models.Value(True)),
-            default=models.Value(False),
-            output_field=models.BooleanField(),
-        ),
-    ).order_by('-created_at')
-    if query:
-        movies = movies.filter(models.Q(title__icontains=query) | models.Q(custom_title__icontains=query))
-    paginator = Paginator(movies, 10)
-    page_obj = paginator.get_page(page_number)
-    response = {
-        'next_page': None,
-        'results': []
-    }
-    if page_obj.has_next():
-        next_url = reverse('movie-list') + '?page=' + str(page_obj.next_page_number())
-        if query:
-            next_url += '&search_by=' + query
-        if user_id:
-            next_url += '&user_id=' + user_id
-        response['next_page'] = next_url
-    for movie in page_obj:
-        response['results'].append({
-            'title': movie.custom_title or movie.title,
-            'release_date': movie.release_date,
-            'created_at': movie.created_at,
-            'updated_at': movie.updated_at,
-            'url': movie.url,
-            'is_favourite': movie.is_favourite
-        })
-    cache.set(key, response, timeout=60 * 5)
-    return JsonResponse(response)
+    catalog_version, favorites_version = list_versions(Movies, user_id)
+    favorite_movies = get_favorites(Movies, user_id, favorites_version)
+    try:
+        if query and matches_custom_name(favorite_movies, query):
+            page = _get_user_movie_page(request, user_id, query, catalog_version, favorites_version, favorite_movies)
+            fragments = page['fragments']
+        else:
+            page = _get_movie_page(request, query, catalog_version)
+            fragments = overlay_fragments(page, favorite_movies, 'title')
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return list_response(request, 'movie-list', page, fragments)
+
+
+def _get_movie_page(request, query, catalog_version):
+    key = catalog_page_key(request, Movies, catalog_version, query)
+    return list_cache.get_or_set(
+        key,
+        lambda: build_page(*paginate(request, movie_queryset(query)), movie_row, 'title'),
+    )
+
+
+def _get_user_movie_page(request, user_id, query, catalog_version, favorites_version, favorites):
+    key = user_page_key(request, Movies, user_id, catalog_version, favorites_version, query)
+    return list_cache.get_or_set(
+        key,
+        lambda: build_page(*paginate(request, user_movie_queryset(user_id, query)), movie_row, 'title', favorites),
+    )
+
+
+@api_view(['GET'])
+def get_top_planets(request, *args, **kwargs):
+    """
+        Returns the planets that are a favorite of the most users, most favorited first, with their favorite_count.
+
+        The planets are read from the index on their favorite counts, the favorites themselves are not queried.
+
+        Parameters:
+        - limit (int, optional): the number of planets to return, 10 by default and at most TOP_FAVORITES_LIMIT
+          (passed as a query parameter)
+    """
+    return _top_favorites(request, Planets, planet_row)
+
+
+@api_view(['GET'])
+def get_top_movies(request, *args, **kwargs):
+    """
+        Returns the movies that are a favorite of the most users, most favorited first, with their favorite_count.
+
+        Parameters:
+        - limit (int, optional): the number of movies to return, 10 by default and at most TOP_FAVORITES_LIMIT
+          (passed as a query parameter)
+    """
+    return _top_favorites(request, Movies, movie_row)
+
+
+def _top_favorites(request, model, row):
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= TOP_FAVORITES_LIMIT:
+        return JsonResponse({'error': 'limit must be between 1 and {}'.format(TOP_FAVORITES_LIMIT)},
+                            status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse({'results': [top_row(obj, row) for obj in top_queryset(model, limit)]})
+
+
+@api_view(['GET'])
+def get_cache_stats(request, *args, **kwargs):
+    """
+        Returns the hit, miss, coalesced and early-refresh counters of the list cache of this process, and the memory
+        used by the favorite sets it holds.
+    """
+    return JsonResponse({**list_cache.stats(), 'favorite_sets': favorite_set_stats()})
@@ -0,0 +1,72 @@
+import threading
+
+from decouple import config
+from django.http import HttpRequest, QueryDict
+
+from core.caching import CATALOG_VERSION_KEY, get_versions
+from core.catalog import name_indexes
+from core.models import Movies, Planets
+from core.search import search_indexes_available
+from core.views import _get_movie_page, _get_planet_page
+from starwars.logger import Logger
+
+logger = Logger()
+
+# number of catalog pages cached by the warm-up, per catalog model
+WARM_UP_PAGES = config('WARM_UP_PAGES', default=3, cast=int)
+
+_warm = threading.Event()
+_warming = threading.Lock()
+
+
+def is_warm():
+    """
+        Returns whether warm_up() completed in this process, or in the process it was forked from.
+    """
+    return _warm.is_set()
+
+
+def warm_up(pages=WARM_UP_PAGES):
+    """
+        Fills what the first requests of a worker would otherwise pay for: the search index probe, the name indexes of
+        the add-favorite endpoints and the list cache entries of the first anonymous catalog pages, which user pages
+        are merged onto. Returns the number of pages cached per catalog model.
+    """
+    search_indexes_available()
+    catalog_version = get_versions(CATALOG_VERSION_KEY)[0]
+    cached = {}
+    for model, get_page in ((Planets, _get_planet_page), (Movies, _get_movie_page)):
+        name_indexes[model].lookup('')
+        params, count = {}, 0
+        while params is not None and count < pages:
+            params = get_page(_page_request(params), None, catalog_version)['next']
+            count += 1
+        cached[model._meta.model_name] = count
+    _warm.set()
+    return cached
+
+
+def ensure_warm():
+    """
+        Warms the process up unless it already is, and returns whether it is warm. Lets processes not started through
+        the gunicorn hooks (runserver, ASGI servers) or whose warm-up failed become ready on their own; a failed
+        warm-up is logged and tried again by the next call, and concurrent calls do not wait for a running one.
+    """
+    if _warm.is_set():
+        return True
+    if not _warming.acquire(blocking=False):
+        return False
+    try:
+        warm_up()
+    except Exception as error:
+        logger.error(msg='Warm-up failed: {!r}'.format(error))
+    finally:
+        _warming.release()
+    return _warm.is_set()
+
+
+def _page_request(params):
+    request = HttpRequest()
+    request.GET = QueryDict(mutable=True)
+    request.GET.update(params)
+    return request
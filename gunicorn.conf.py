@@ -0,0 +1,68 @@
+"""
+    Gunicorn settings of the production server started by autostart.sh.
+
+    The application is loaded and warmed up once in the master process before the workers are forked, so the workers
+    start ready and share the loaded code, name indexes and cached pages copy-on-write.
+"""
+import multiprocessing
+import os
+
+import decouple
+
+bind = decouple.config('BIND', default='0.0.0.0:8000')
+workers = decouple.config('WEB_CONCURRENCY', default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+# `uvicorn.workers.UvicornWorker` serves starwars.asgi:application, and the async views with ASYNC_VIEWS=true
+worker_class = decouple.config('GUNICORN_WORKER_CLASS', default='sync')
+threads = decouple.config('GUNICORN_THREADS', default=1, cast=int)
+timeout = decouple.config('GUNICORN_TIMEOUT', default=30, cast=int)
+# recycled workers are forked again from the warm master
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=0, cast=int)
+max_requests_jitter = decouple.config('GUNICORN_MAX_REQUESTS_JITTER', default=0, cast=int)
+preload_app = decouple.config('GUNICORN_PRELOAD', default=True, cast=bool)
+
+
+def on_starting(server):
+    # the version counters invalidating cached pages, and the locks against stampedes, live in the Django cache: with a
+    # process-local backend every worker would keep its own and serve pages the others retired
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'starwars.settings')
+    from django.conf import settings
+    if server.cfg.workers > 1 and not settings.SHARED_CACHE:
+        raise RuntimeError(
+            '{} workers cannot share the process-local cache backend {}: set CACHE_BACKEND to a shared backend '
+            '(redis or memcached) or WEB_CONCURRENCY=1'.format(server.cfg.workers, settings.CACHE_BACKEND)
+        )
+    if server.cfg.workers > 1 and settings.CACHE_BACKEND not in settings.ATOMIC_CACHE_BACKENDS:
+        server.log.warning(
+            'The cache backend %s does not increment counters atomically across the %s workers: concurrent writes '
+            'may leave stale cached pages until they expire, use redis or memcached', settings.CACHE_BACKEND,
+            server.cfg.workers,
+        )
+
+
+def when_ready(server):
+    # runs in the master before the workers are forked, once the application is loaded when it is preloaded
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+
+    from core.warmup import warm_up
+    try:
+        server.log.info('Warmed up: %s', warm_up())
+    except Exception:
+        # every worker tries again, and reports not ready until it succeeds
+        server.log.exception('Warm-up failed')
+    finally:
+        # a connection opened before fork() would be shared by all the workers
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    # a failed warm-up is logged, and tried again by the readiness probe
+    from core.warmup import ensure_warm
+    ensure_warm()
+
+
+def worker_exit(server, worker):
+    # favorites still waiting in the write-behind buffer are written before the worker exits
+    from core.favorites import favorite_buffer
+    favorite_buffer.close()
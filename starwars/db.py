@@ -0,0 +1,72 @@
+from decouple import config
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+# alias of the read-only connection the core reads are routed to, when settings.DATABASES defines it
+READ_ALIAS = 'reader'
+
+# pragmas run on every new SQLite connection, see https://www.sqlite.org/pragma.html
+SQLITE_PRAGMAS = {
+    # with WAL, NORMAL only syncs at checkpoints: a power loss may lose the last commits, never corrupt the database
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-64000, cast=int),
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    'temp_store': 'MEMORY',
+}
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+        Tunes every new SQLite connection. Writable connections also switch the database to WAL mode, which persists
+        in the database file: readers then read the last committed state without waiting for writers, and writers do
+        not wait for readers. The READ_ALIAS connection refuses writes even when it does not open the database in
+        read-only mode, as when it mirrors the default one in tests.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if is_read_only(connection):
+            cursor.execute('PRAGMA query_only=ON')
+        else:
+            cursor.execute('PRAGMA journal_mode=WAL')
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+
+
+def is_read_only(connection):
+    if connection.alias == READ_ALIAS:
+        return True
+    return connection.settings_dict['OPTIONS'].get('uri', False) and 'mode=ro' in str(connection.settings_dict['NAME'])
+
+
+connection_created.connect(configure_sqlite)
+
+
+class ReadWriteRouter:
+    """
+        Routes the reads of the core models to the read-only READ_ALIAS connection and every write to the default one.
+
+        Reads made while the default connection is in a transaction stay on it, so they see what the transaction
+        wrote; that includes get_or_create() and the diffs of the catalog upserts.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'core' or READ_ALIAS not in settings.DATABASES:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases open the same database
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, READ_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != READ_ALIAS
@@ -1,95 +1,214 @@
-import inspect
-import json
+import atexit
 import logging
+import queue
+import random
 import sys
+import threading
+import time
 import traceback
-from datetime import datetime, date
+from collections import OrderedDict
+from datetime import datetime, date, timezone
 import os
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from decouple import config
 from pythonjsonlogger import jsonlogger
 
+LOG_FORMAT = '%(timestamp)s %(level)s %(name)s %(message)s'
+
+HOST_NAME = os.getenv('HOSTNAME') or 'default'
+
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
     def add_fields(self, log_record, record, message_dict):
         super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
         if not log_record.get('timestamp'):
-            # this doesn't use record.created, so it is slightly off
-            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            now = datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
             log_record['timestamp'] = now
         if log_record.get('level'):
             log_record['level'] = log_record['level'].upper()
         else:
             log_record['level'] = record.levelname
-
-
-def fetch_loging_function_name(f_p=3) -> str:
-    try:
-        frames = traceback.walk_stack(None)
-        s = traceback.StackSummary.extract(frames)
-        f = s[f_p]
-        function_name = str(f.name)
-    except Exception:
-        function_name = ''
-    return function_name
+        # Logger logs with a stacklevel pointing at its caller, so the record already knows the calling function
+        if not log_record.get('function_name'):
+            log_record['function_name'] = record.funcName
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+        Queues records untouched, instead of formatting them on the logging thread like QueueHandler does: the dict
+        message of a record is encoded once, by the formatter of the handler behind the QueueListener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def parse_sample_rates(value):
+    """
+        Parses LOG_SAMPLE_RATES: comma separated `LEVEL=rate` items, optionally scoped to the function logging them
+        with `function:LEVEL=rate`, e.g. `INFO=0.01,add_favorite_movie:INFO=0.1`. Returns a {(function or None, level
+        number): rate} dict.
+    """
+    rates = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        target, rate = item.split('=')
+        site, _, level_name = target.strip().rpartition(':')
+        level = logging.getLevelName(level_name.upper())
+        if not isinstance(level, int):
+            raise ValueError('Unknown log level in LOG_SAMPLE_RATES: {}'.format(level_name))
+        rates[site or None, level] = float(rate)
+    return rates
+
+
+class LogSampler:
+    """
+        Decides which share of the calls of each level, and of each level in a given function, is logged. Levels
+        without a configured rate are always logged.
+    """
+
+    def __init__(self, rates):
+        self.rates = rates
+        self.by_site = any(site for site, level in rates)
+
+    def rate(self, level, site=None):
+        return self.rates.get((site, level), self.rates.get((None, level), 1.0))
+
+
+class MessageRateLimiter:
+    """
+        A token bucket per distinct message: the same message can be logged `burst` times in a row, then `rate` times
+        per second, and the copies dropped in between are counted. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst, max_messages=1024):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_messages = max_messages
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """
+            Returns whether the message may be logged now, and how many copies of it were suppressed since it last
+            was.
+        """
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # [tokens, last refill, suppressed copies]
+                bucket = self._buckets[key] = [self.burst, now, 0]
+                if len(self._buckets) > self.max_messages:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False, 0
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return True, suppressed
+
+
+def build_handler(file_name):
+    """
+        Returns the handler of the application logger. Unless LOG_ASYNC is disabled, records are only queued on the
+        logging thread, and formatted and written by a background QueueListener thread, stopped (and drained) at exit
+        and started again in forked processes.
+    """
+    if config('LOG_LEVEL') == "DEBUG":
+        log_handler = logging.StreamHandler()
+        log_handler.setLevel(logging.DEBUG)
+    else:
+        log_dir = config('LOG_DIR')
+        if not os.path.exists(log_dir):
+            os.mkdir(log_dir)
+        log_handler = RotatingFileHandler(
+            os.path.join(log_dir, file_name + '.log'),
+            maxBytes=config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int),
+            backupCount=config('LOG_BACKUP_COUNT', default=5, cast=int),
+        )
+        log_handler.setLevel(logging.DEBUG)
+    log_handler.setFormatter(CustomJsonFormatter(LOG_FORMAT, json_default=Logger.serialize_sets))
+
+    if not config('LOG_ASYNC', default=True, cast=bool):
+        return log_handler
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, log_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # threads do not survive fork(): every worker forked from a preloaded server starts its own listener
+    os.register_at_fork(after_in_child=lambda: _restart_listener(listener))
+    return RecordQueueHandler(records)
+
+
+def _restart_listener(listener):
+    listener._thread = None
+    listener.start()
 
 
 class Logger:
 
     def __init__(self):
-        self._logger = logging.getLogger(__name__)
-        formatter = CustomJsonFormatter('%(timestamp)s %(level)s %(name)s %(message)s')
-        file_name = config('APP_LOG_FILE')
-        log_dir = config('LOG_DIR')
-        file_path = os.path.join(log_dir, file_name + '.log')
-        self._logger= logging.getLogger(file_name)
-
-        if config('LOG_LEVEL') == "DEBUG":
-            log_handler = logging.StreamHandler()
-            log_handler.setLevel(logging.DEBUG)
-        else:
-            if not os.path.exists(log_dir):
-                os.mkdir(log_dir)
-            log_handler = RotatingFileHandler(
-                file_path,
-                maxBytes=10,
-                backupCount=0
-            )
-            log_handler.setLevel(logging.DEBUG)
-        log_handler.setFormatter(formatter)
-        self._logger.addHandler(log_handler)
+        self._logger = logging.getLogger(config('APP_LOG_FILE'))
+        # every module creates its own Logger for the same logging.Logger: only the first one installs the handler
+        if not self._logger.handlers:
+            self._logger.addHandler(build_handler(self._logger.name))
+        self._sampler = sampler
+        self._limiter = limiter
 
     def error(self, msg):
-        data_dict, func_name = self.generate_data_for_logger(level='ERROR', msg=msg)
-        self._logger.error(data_dict)
+        self._log(logging.ERROR, 'ERROR', msg)
 
     def info(self, msg):
-        data_dict, func_name = self.generate_data_for_logger(level='INFO', msg=msg)
-        self._logger.info(data_dict)
+        self._log(logging.INFO, 'INFO', msg)
 
     def warn(self, msg):
-        data_dict, func_name = self.generate_data_for_logger(level='WARN', msg=msg)
-        self._logger.warning(data_dict)
+        self._log(logging.WARNING, 'WARN', msg)
 
     def debug(self, msg):
-        data_dict, func_name = self.generate_data_for_logger(level='DEBUG', msg=msg)
-        self._logger.debug(data_dict)
+        self._log(logging.DEBUG, 'DEBUG', msg)
 
     def critical(self, msg):
-        data_dict, func_name = self.generate_data_for_logger(level='CRITICAL', msg=msg)
-        self._logger.critical(data_dict)
+        self._log(logging.CRITICAL, 'CRITICAL', msg)
+
+    def _log(self, level, level_name, msg):
+        # nothing is built for disabled levels, sampled out calls or repeated messages over their rate limit
+        if not self._logger.isEnabledFor(level):
+            return
+        # frame 2 is the caller of error(), info(), ...
+        rate = self._sampler.rate(level, sys._getframe(2).f_code.co_name if self._sampler.by_site else None)
+        if rate < 1 and random.random() >= rate:
+            return
+        allowed, suppressed = self._limiter.allow((level, msg if type(msg) == str else repr(msg)))
+        if not allowed:
+            return
+
+        data_dict = self.generate_data_for_logger(level=level_name, msg=msg)
+        if rate < 1:
+            data_dict['sample_rate'] = rate
+        if suppressed:
+            data_dict['suppressed'] = suppressed
+        # stacklevel 3 attributes the record to the caller of error(), info(), ...
+        self._logger.log(level, data_dict, stacklevel=3)
 
-    def generate_data_for_logger(self, level, msg):
-        function_name = fetch_loging_function_name()
-        host_name = os.getenv('HOSTNAME')
+    @staticmethod
+    def generate_data_for_logger(level, msg):
+        """
+            Returns the fields of a log line as a dict, JSON-encoded once by the formatter along with the timestamp,
+            level and calling function of the record.
+        """
         data_dict = {
-            'host_name': host_name if host_name else 'default',
+            'host_name': HOST_NAME,
             'service': 'starwars',
             'log_level': level,
             'index': 'cr_' + str(datetime.today()),
             'message': '',
-            'function_name': str(function_name)
         }
         if level == 'ERROR':
             data_dict.update({'traceback': traceback.format_exc()})
@@ -99,10 +218,7 @@ class Logger:
             data_dict['message'] = msg
         else:
             data_dict['message'] = str(msg)
-        try:
-            return json.dumps(data_dict), str(function_name)
-        except Exception:
-            return json.dumps(data_dict, default=self.serialize_sets), str(function_name)
+        return data_dict
 
     @staticmethod
     def serialize_sets(obj):
@@ -111,5 +227,12 @@ class Logger:
         if isinstance(obj, (datetime, date)):
             return str(obj)
 
-        return obj
+        return str(obj)
+
+
+sampler = LogSampler(config('LOG_SAMPLE_RATES', default='', cast=parse_sample_rates))
 
+limiter = MessageRateLimiter(
+    rate=config('LOG_RATE_LIMIT', default=1.0, cast=float),
+    burst=config('LOG_RATE_LIMIT_BURST', default=10, cast=int),
+)
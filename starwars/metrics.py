@@ -0,0 +1,234 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+# upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# a metric reported by a collector: samples is a list of ({label: value}, value) pairs
+Metric = namedtuple('Metric', ['name', 'kind', 'help', 'samples'])
+
+
+class _Shard:
+    def __init__(self):
+        self.requests = Counter()
+        self.buckets = Counter()
+        self.seconds = Counter()
+        self.queries = Counter()
+        self.sql_seconds = Counter()
+        self.cache_events = Counter()
+
+
+class RequestMetrics:
+    """
+        Per-view request metrics of the process: status counts, latency histograms, number of SQL queries and time
+        spent in them, and list cache lookups by outcome.
+
+        Every thread records into its own shard, so recording a request takes no lock; shards are only merged when the
+        metrics are rendered. Other parts of the project report their own metrics through register_collector().
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def observe(self, view, status, seconds, queries=0, sql_seconds=0.0, cache_events=None):
+        shard = self._shard()
+        shard.requests[view, status] += 1
+        shard.buckets[view, bisect_left(self.buckets, seconds)] += 1
+        shard.seconds[view] += seconds
+        shard.queries[view] += queries
+        shard.sql_seconds[view] += sql_seconds
+        for event, count in (cache_events or {}).items():
+            shard.cache_events[view, event] += count
+
+    def register_collector(self, collector):
+        """
+            Registers a function returning a list of Metric, called every time the metrics are rendered.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """
+            Returns the merged counters of all the threads.
+        """
+        merged = _Shard()
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict copies are atomic, the owning thread may keep recording meanwhile
+            for name in ('requests', 'buckets', 'seconds', 'queries', 'sql_seconds', 'cache_events'):
+                getattr(merged, name).update(getattr(shard, name).copy())
+        return merged
+
+    def render(self):
+        """
+            Returns the metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        views = sorted(snapshot.seconds)
+        families = [
+            Metric('starwars_http_requests_total', 'counter', 'Requests by view and status code.', [
+                ({'view': view, 'status': status}, count) for (view, status), count in sorted(snapshot.requests.items())
+            ]),
+            Metric('starwars_http_request_duration_seconds', 'histogram', 'Request latency by view.', [
+                sample for view in views for sample in self._histogram(snapshot, view)
+            ]),
+            Metric('starwars_db_queries_total', 'counter', 'SQL queries run by view.', [
+                ({'view': view}, snapshot.queries[view]) for view in views
+            ]),
+            Metric('starwars_db_query_duration_seconds_total', 'counter', 'Time spent in SQL queries by view.', [
+                ({'view': view}, snapshot.sql_seconds[view]) for view in views
+            ]),
+            Metric('starwars_list_cache_events_total', 'counter', 'List cache lookups by view and outcome.', [
+                ({'view': view, 'event': event}, count)
+                for (view, event), count in sorted(snapshot.cache_events.items())
+            ]),
+        ]
+        for collector in self._collectors:
+            families.extend(collector())
+        return ''.join(_render_metric(metric) for metric in families)
+
+    def clear(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.__init__()
+
+    def _histogram(self, snapshot, view):
+        cumulative = 0
+        for index, bound in enumerate(self.buckets + (float('inf'),)):
+            cumulative += snapshot.buckets[view, index]
+            yield {'view': view, 'le': bound, '__suffix': '_bucket'}, cumulative
+        yield {'view': view, '__suffix': '_sum'}, snapshot.seconds[view]
+        yield {'view': view, '__suffix': '_count'}, cumulative
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+
+def _render_metric(metric):
+    lines = ['# HELP {} {}\n# TYPE {} {}\n'.format(metric.name, metric.help, metric.name, metric.kind)]
+    for labels, value in metric.samples:
+        labels = dict(labels)
+        name = metric.name + labels.pop('__suffix', '')
+        rendered = ','.join('{}="{}"'.format(key, _label_value(label)) for key, label in labels.items())
+        lines.append('{}{} {}\n'.format(name, '{' + rendered + '}' if rendered else '', _number(value)))
+    return ''.join(lines)
+
+
+def _label_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = RequestMetrics()
+
+
+class _RequestStats:
+    __slots__ = ('queries', 'seconds', 'cache_events')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.cache_events = Counter()
+
+
+# statistics of the request being handled, shared with the threads sync_to_async runs its database queries in
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def record_cache_event(event):
+    """
+        Counts a cache lookup outcome for the request being handled, if any.
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.cache_events[event] += 1
+
+
+def _track_queries(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.seconds += time.perf_counter() - started
+
+
+def _watch_queries(connection, **kwargs):
+    if _track_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_queries)
+
+
+connection_created.connect(_watch_queries)
+
+
+class MetricsMiddleware:
+    """
+        Records the latency, status code, SQL queries and cache lookups of every request in `metrics`, under the URL name
+        of its view.
+        Works with sync and async views alike.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # connections opened before this middleware was loaded did not go through connection_created
+        _watch_queries(connection)
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._observe(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._observe(request, response, time.perf_counter() - started, stats)
+        return response
+
+    @staticmethod
+    def _observe(request, response, seconds, stats):
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        metrics.observe(
+            view, response.status_code, seconds, stats.queries, stats.seconds, stats.cache_events,
+        )
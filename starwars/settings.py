@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from urllib.parse import quote
+
+from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,6 +51,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'starwars.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,17 +81,92 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'starwars.wsgi.application'
 
+# Serve the list and add-favorite endpoints with the native async views of core.async_views; only worth enabling when
+# the project runs under an ASGI server (starwars.asgi), under WSGI every async view runs in its own event loop.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# Encoder of the list responses: core.encoding.fast_dumps (orjson when installed) or core.encoding.django_dumps
+JSON_ENCODER = config('JSON_ENCODER', default='core.encoding.fast_dumps')
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+DATABASE_PATH = config('DATABASE_PATH', default=str(BASE_DIR / 'db.sqlite3'))
+
+# seconds a connection is kept open across requests, 0 closes it at the end of every request
+CONN_MAX_AGE = config('CONN_MAX_AGE', default=600, cast=int)
+
 DATABASES = {
     'default': {
+        # django.db.backends.sqlite3 with write transactions taking the write lock up front
+        'ENGINE': 'starwars.sqlite',
+        'NAME': DATABASE_PATH,
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+# the list and catalog reads go through a read-only connection, see starwars/db.py
+if config('DATABASE_READER', default=True, cast=bool):
+    DATABASES['reader'] = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': 'file:{}?mode=ro'.format(quote(DATABASE_PATH)),
+        'OPTIONS': {'uri': True},
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['starwars.db.ReadWriteRouter']
+
+
+# Cache
+# The list views keep a small in-process LRU in front of this cache; point it at a backend shared by all workers
+# (memcached, redis, ...) in production so cache entries and version counters are shared between processes.
+
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
+# backends culling a third of their entries at random once they hold MAX_ENTRIES (300 by default), version counters
+# included: they are given room for the pages, favorites and counters of the active users
+CULLING_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.db.DatabaseCache',
+}
+if CACHE_BACKEND in CULLING_CACHE_BACKENDS:
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)}
+
+# backends incrementing and adding keys atomically across processes, as the version counters and the locks against
+# stampedes need once several workers share them
+ATOMIC_CACHE_BACKENDS = {
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+}
+
+# backends whose entries live in the memory of one process: the version counters bumped by load_data/import_catalog or
+# by another worker never reach the others, so their entries must expire quickly instead
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+SHARED_CACHE = CACHE_BACKEND not in PROCESS_LOCAL_CACHE_BACKENDS
+
+# cached entries never go stale on a shared backend thanks to the versions in their keys, so they can live for hours;
+# on a process-local one they only live a few minutes, whatever CACHE_TIMEOUT asks for
+LOCAL_CACHE_MAX_TIMEOUT = 60 * 5
+CACHE_TIMEOUT = config('CACHE_TIMEOUT', default=60 * 60 * 6 if SHARED_CACHE else LOCAL_CACHE_MAX_TIMEOUT, cast=int)
+if not SHARED_CACHE:
+    CACHE_TIMEOUT = min(CACHE_TIMEOUT, LOCAL_CACHE_MAX_TIMEOUT)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
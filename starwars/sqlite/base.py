@@ -0,0 +1,12 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+        SQLite backend starting its transactions with BEGIN IMMEDIATE, which waits up to the busy timeout for the
+        write lock. A deferred BEGIN only asks for it at the first write, and fails right away with "database is
+        locked" when another connection wrote in between.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
-from starwars.views import health_check
+from starwars.views import get_metrics, health_check, readiness_check
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('knockknock/', health_check, name='knockknock'),
+    path('knockknock/ready', readiness_check, name='readiness'),
+    path('metrics', get_metrics, name='metrics'),
     path('core/', include('core.urls')),
 ]
@@ -1,8 +1,44 @@
-from django.http import JsonResponse
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, JsonResponse
+from rest_framework import status
 from rest_framework.decorators import api_view
 
+from core.warmup import ensure_warm
+from starwars.metrics import metrics
+
 
 @api_view(['GET'])
-def health_check():
+def health_check(request):
+    """
+        Liveness probe: returns 200 as long as the process answers requests.
+    """
     data = {'status': 'ok'}
     return JsonResponse(data)
+
+
+@api_view(['GET'])
+def readiness_check(request):
+    """
+        Readiness probe: returns 200 once the process is warmed up (see core.warmup) and its database answers, 503
+        before. The probe warms the process up itself when it is not yet, whatever server it runs in.
+    """
+    checks = {'warm': ensure_warm(), 'database': _database_available()}
+    ready = all(checks.values())
+    data = dict(checks, status='ready' if ready else 'not ready')
+    return JsonResponse(data, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+def _database_available():
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        return False
+
+
+def get_metrics(request):
+    """
+        Returns the request, database and cache metrics of the answering process in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')